@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the memory used by model instances with a DictionaryField loaded
+from the database and the work left to the cyclic garbage collector.
+
+No database connection is needed, rows are built through ``Model.from_db``
+exactly as the ORM does.
+
+usage: ./benchmarks/hstore_dict_memory.py [rows] [keys]
+"""
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings_psycopg')
+
+import django  # noqa
+django.setup()
+
+from django_hstore_tests.models import DataBag  # noqa
+
+
+def load(rows, keys):
+    field = DataBag._meta.get_field('data')
+    raw = dict(('key%d' % i, 'value%d' % i) for i in range(keys))
+    return [DataBag.from_db('default', None, [pk, 'bag', field.from_db_value(dict(raw), None, None, {})])
+            for pk in range(rows)]
+
+
+def main(rows=1000000, keys=10):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    bags = load(rows, keys)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.time()
+    gc.collect()
+    collect_time = time.time() - start
+    del bags
+    unreachable = gc.collect()
+    print('rows: %d, keys per row: %d' % (rows, keys))
+    print('load time: %.2fs' % elapsed)
+    print('memory: %.1f MiB (%.0f bytes per row), peak %.1f MiB' % (
+        current / 1048576.0, current / float(rows), peak / 1048576.0))
+    print('full collection with rows alive: %.2fs' % collect_time)
+    print('unreachable objects freed by the cyclic collector: %d' % unreachable)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
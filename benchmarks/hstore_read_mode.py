@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the decoding of hstore values retrieved in the default read mode,
+which psycopg2 parses with a regular expression (``HstoreAdapter.parse``),
+with the ``array`` read mode, which selects ``hstore_to_array(column)``
+that psycopg2 decodes natively, the dictionary is then built with a single zip.
+
+The rows are generated by the database. If the hstore extension is not
+available the hstore text representation and the flat text arrays are
+generated without it, which is what the two read modes transfer anyway.
+
+usage: ./benchmarks/hstore_read_mode.py [dsn] [rows] [width, ...]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import psycopg2
+from psycopg2.extensions import STRINGARRAY
+from psycopg2.extras import HstoreAdapter
+
+HSTORE_QUERY = """
+    SELECT hstore(array_agg('key' || k), array_agg('value ' || k || ' of ' || r))
+    FROM generate_series(1, %(rows)s) r, generate_series(1, %(width)s) k GROUP BY r ORDER BY r
+"""
+HSTORE_TEXT_QUERY = """
+    SELECT string_agg(format('"key%%s"=>"value %%s of %%s"', k, k, r), ', ')
+    FROM generate_series(1, %(rows)s) r, generate_series(1, %(width)s) k GROUP BY r ORDER BY r
+"""
+ARRAY_TEXT_QUERY = """
+    SELECT array_agg(v ORDER BY k, i)::text
+    FROM generate_series(1, %(rows)s) r, generate_series(1, %(width)s) k,
+         LATERAL (VALUES (1, 'key' || k), (2, 'value ' || k || ' of ' || r)) AS kv(i, v)
+    GROUP BY r ORDER BY r
+"""
+
+
+def has_hstore(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS hstore')
+    except psycopg2.Error:
+        connection.rollback()
+        return False
+    connection.commit()
+    return True
+
+
+def fetch_texts(cursor, query, rows, width, hstore):
+    if hstore:
+        query = 'SELECT (%s)::text FROM (%s) AS rows(value)' % (
+            'hstore_to_array(value)' if query is ARRAY_TEXT_QUERY else 'value', HSTORE_QUERY)
+    cursor.execute(query, {'rows': rows, 'width': width})
+    return [row[0] for row in cursor.fetchall()]
+
+
+def decode_hstore(texts, cursor):
+    parse = HstoreAdapter.parse_unicode if sys.version_info[0] < 3 else HstoreAdapter.parse
+    return [parse(text, cursor) for text in texts]
+
+
+def decode_array(texts, cursor):
+    result = []
+    for text in texts:
+        items = iter(STRINGARRAY(text, cursor))
+        result.append(dict(zip(items, items)))
+    return result
+
+
+def measure(function, texts, cursor, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function(texts, cursor)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(dsn='dbname=django_hstore_psycopg2', rows=10000, *widths):
+    rows = int(rows)
+    widths = [int(width) for width in widths] or [1, 10, 50, 200]
+    connection = psycopg2.connect(dsn)
+    hstore = has_hstore(connection)
+    cursor = connection.cursor()
+    print('rows: %d, values generated %s the hstore extension' % (rows, 'with' if hstore else 'without'))
+    print('%8s %12s %12s %9s' % ('width', 'regex', 'array', 'speedup'))
+    for width in widths:
+        hstore_texts = fetch_texts(cursor, HSTORE_TEXT_QUERY, rows, width, hstore)
+        array_texts = fetch_texts(cursor, ARRAY_TEXT_QUERY, rows, width, hstore)
+        assert decode_hstore(hstore_texts[:10], cursor) == decode_array(array_texts[:10], cursor)
+        regex = measure(decode_hstore, hstore_texts, cursor)
+        array = measure(decode_array, array_texts, cursor)
+        print('%8d %11.3fs %11.3fs %8.1fx' % (width, regex, array, regex / array))
+    connection.close()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the serializer backends of SerializedDictionaryField encoding
+and decoding whole dictionaries, with the former per value calls to
+json.dumps and json.loads as reference; no database connection is needed.
+
+usage: ./benchmarks/serializer_backends.py [dictionaries] [keys]
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from django.core.exceptions import ImproperlyConfigured  # noqa
+
+from django_hstore.serializers import get_serializer  # noqa
+
+
+def sample_dict(keys):
+    values = [True, 0, 12.5, 'text value', ['tag1', 'tag2'], {'nested': [1, 2, 3]}, None, 123456789]
+    return dict(('key%d' % i, values[i % len(values)]) for i in range(keys))
+
+
+def legacy_dumps_dict(value):
+    return dict((k, v if v is None else json.dumps(v)) for k, v in value.items())
+
+
+def legacy_loads_dict(value):
+    return dict((k, json.loads(v) if v is not None else v) for k, v in value.items())
+
+
+def measure(function, dictionaries):
+    start = time.time()
+    result = [function(d) for d in dictionaries]
+    return time.time() - start, result
+
+
+def main(count=10000, keys=50):
+    count, keys = int(count), int(keys)
+    dictionaries = [sample_dict(keys) for i in range(count)]
+    print('dictionaries: %d, keys per dictionary: %d' % (count, keys))
+    print('%-20s %10s %10s' % ('backend', 'dumps', 'loads'))
+    dumps_time, encoded = measure(legacy_dumps_dict, dictionaries)
+    loads_time, decoded = measure(legacy_loads_dict, encoded)
+    print('%-20s %9.3fs %9.3fs' % ('json (per value)', dumps_time, loads_time))
+    for name in ('json', 'orjson', 'ujson', 'msgpack'):
+        try:
+            serializer = get_serializer(name)
+        except ImproperlyConfigured:
+            print('%-20s %10s' % (name, 'not installed'))
+            continue
+        dumps_time, encoded = measure(serializer.dumps_dict, dictionaries)
+        loads_time, decoded = measure(serializer.loads_dict, encoded)
+        assert decoded[0] == dictionaries[0]
+        print('%-20s %9.3fs %9.3fs' % (name, dumps_time, loads_time))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,93 @@
+from __future__ import unicode_literals, absolute_import
+
+from decimal import Decimal
+
+from django.db import models
+from django.db.models.aggregates import Aggregate
+
+from django_hstore.expressions import HStoreKey, get_output_field
+
+
+__all__ = [
+    'HStoreAggregate',
+    'Sum',
+    'Avg',
+    'Min',
+    'Max',
+    'Count',
+    'Percentile'
+]
+
+
+class PercentileCont(Aggregate):
+    function = 'percentile_cont'
+    name = 'Percentile'
+    template = '%(function)s(%(fraction)r) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fraction, **extra):
+        super(PercentileCont, self).__init__(expression, fraction=float(fraction),
+                                             output_field=models.FloatField(), **extra)
+
+    def convert_value(self, value, expression, connection, context):
+        return float(value) if value is not None else value
+
+
+class HStoreAggregate(object):
+    """
+    Aggregation of the values of an hstore key (see ``HStoreQuerySet.haggregate``),
+    the values are cast according to ``cast`` (see ``get_cast_for_param``).
+    """
+    aggregate = None
+    # cast of the values if not specified, numeric aggregates can't be performed on strings
+    # and strings don't sort as numbers (pass ``str`` to compare the values as stored)
+    default_cast = None
+
+    def __init__(self, key, cast=None):
+        self.key = key
+        self.cast = cast if cast is not None else self.default_cast
+
+    def get_expression(self, attr):
+        output_field = get_output_field(self.cast) if self.cast is not None else None
+        return self.aggregate(HStoreKey(attr, self.key, output_field=output_field))
+
+
+class Sum(HStoreAggregate):
+    aggregate = models.Sum
+    default_cast = Decimal
+
+
+class Avg(HStoreAggregate):
+    aggregate = models.Avg
+    default_cast = float
+
+
+class Min(HStoreAggregate):
+    aggregate = models.Min
+    default_cast = Decimal
+
+
+class Max(HStoreAggregate):
+    aggregate = models.Max
+    default_cast = Decimal
+
+
+class Count(HStoreAggregate):
+    """
+    Number of rows having the key.
+    """
+    aggregate = models.Count
+
+
+class Percentile(HStoreAggregate):
+    """
+    Continuous percentile, ``fraction`` between 0 and 1 (eg: 0.5 for the median).
+    """
+    default_cast = float
+
+    def __init__(self, key, fraction, cast=None):
+        super(Percentile, self).__init__(key, cast)
+        self.fraction = fraction
+
+    def get_expression(self, attr):
+        output_field = get_output_field(self.cast)
+        return PercentileCont(HStoreKey(attr, self.key, output_field=output_field), self.fraction)
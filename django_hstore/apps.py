@@ -2,11 +2,16 @@ import sys
 
 import django
 from django.conf import settings
+from django.core.signals import request_started
 from django.db.backends.signals import connection_created
+from django.db.models.signals import class_prepared
 from django.apps import AppConfig
 
 from psycopg2.extras import register_hstore
 
+from django_hstore.cache import clear_request_reference_cache
+from django_hstore.utils import clear_reference_cache
+
 
 HSTORE_REGISTER_GLOBALLY = getattr(settings, "DJANGO_HSTORE_ADAPTER_REGISTRATION", "global") == "global"
 CONNECTION_CREATED_SIGNAL_WEAKREF = bool(getattr(settings, "DJANGO_HSTORE_ADAPTER_SIGNAL_WEAKREF", False))
@@ -89,3 +94,8 @@ class HStoreConfig(AppConfig):
         connection_created.connect(connection_handler,
                                    weak=CONNECTION_CREATED_SIGNAL_WEAKREF,
                                    dispatch_uid="_connection_create_handler")
+        # model classes of references are cached, invalidate when the registry changes
+        class_prepared.connect(clear_reference_cache,
+                               dispatch_uid="_clear_reference_cache")
+        request_started.connect(clear_request_reference_cache,
+                                dispatch_uid="_clear_request_reference_cache")
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.utils.encoding import force_text
+
+
+__all__ = [
+    'ReferenceCache',
+    'get_reference_cache',
+    'clear_request_reference_cache'
+]
+
+
+class ReferenceCache(object):
+    """
+    Thread safe LRU cache of referenced model instances
+    with optional expiration of the entries after ``ttl`` seconds.
+    """
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        _caches.add(self)
+
+    def get(self, model, pk):
+        """
+        Returns the cached instance or None if not present or expired.
+        """
+        key = (model._meta.concrete_model, force_text(pk))
+        with self._lock:
+            try:
+                instance, expires = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires is not None and expires < time.time():
+                return None
+            # reinsert the entry to mark it as the most recently used
+            self._entries[key] = (instance, expires)
+            return instance
+
+    def set(self, model, pk, instance):
+        key = (model._meta.concrete_model, force_text(pk))
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (instance, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, model, pk):
+        with self._lock:
+            self._entries.pop((model._meta.concrete_model, force_text(pk)), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _ProcessScope(object):
+    cache = None
+
+
+# all the live caches, needed to invalidate the instances cached by every thread
+_caches = weakref.WeakSet()
+_process = _ProcessScope()
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _invalidate_reference(sender, instance, **kwargs):
+    """
+    Invalidates the cached instances of the saved or deleted row, connected without sender
+    since proxy models are senders too; the rows of the parent models are invalidated as well.
+    """
+    caches = list(_caches)
+    if not caches:
+        return
+    models = [instance._meta.concrete_model] + list(instance._meta.get_parent_list())
+    for cache in caches:
+        for model in models:
+            cache.delete(model, instance.pk)
+
+
+post_save.connect(_invalidate_reference, dispatch_uid='django_hstore.cache.invalidate_reference')
+post_delete.connect(_invalidate_reference, dispatch_uid='django_hstore.cache.invalidate_reference')
+
+
+def get_reference_cache():
+    """
+    Returns the reference cache of the configured scope
+    (``process``, ``thread`` or ``request``) or None if disabled.
+    """
+    options = getattr(settings, 'DJANGO_HSTORE_REFERENCE_CACHE', None)
+    if not options:
+        return None
+    holder = _process if options.get('SCOPE', 'request') == 'process' else _local
+    cache = getattr(holder, 'cache', None)
+    if cache is None or cache.options != options:
+        with _lock:
+            cache = getattr(holder, 'cache', None)
+            if cache is None or cache.options != options:
+                cache = ReferenceCache(options.get('MAXSIZE', 1000), options.get('TTL'))
+                cache.options = options
+                holder.cache = cache
+    return cache
+
+
+def clear_request_reference_cache(**kwargs):
+    """
+    Clears the cache of the current thread when it's scoped per request,
+    connected to the ``request_started`` signal.
+    """
+    options = getattr(settings, 'DJANGO_HSTORE_REFERENCE_CACHE', None)
+    if options and options.get('SCOPE', 'request') == 'request':
+        cache = getattr(_local, 'cache', None)
+        if cache is not None:
+            cache.clear()
@@ -6,6 +6,8 @@ class UnicodeMixin(object):
     Mixin class to handle defining the proper __str__/__unicode__
     methods in Python 2 or 3.
     """
+    __slots__ = ()
+
     if sys.version_info[0] >= 3:  # Python 3
         def __str__(self):
             return self.__unicode__()
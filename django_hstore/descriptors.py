@@ -1,4 +1,6 @@
-from .dict import HStoreDict, HStoreReferenceDict
+import copy
+
+from .dict import FrozenHStoreDict, HStoreDict, HStoreReferenceDict, LazySerializedDict, PartialHStoreDict
 
 __all__ = [
     'HStoreDescriptor',
@@ -31,6 +33,27 @@ class HStoreDescriptor(Creator):
         super(HStoreDescriptor, self).__init__(*args, **kwargs)
 
     def __set__(self, obj, value):
+        # dictionaries built from database values can be bound as they are
+        # while the instance is being built from the same database row
+        if (type(value) is self._DictClass or type(value) is PartialHStoreDict) and value._from_db \
+                and obj._state.adding:
+            value._from_db = False
+            value.instance = obj
+            value.track_changes()
+            obj.__dict__[self.field.name] = value
+            return
+        # partial dictionaries stay partial, otherwise the keys which
+        # haven't been loaded would be removed when saving
+        if isinstance(value, PartialHStoreDict) and value.partial:
+            if value.instance is not obj:
+                value = copy.copy(value)
+                value.instance = obj
+            obj.__dict__[self.field.name] = value
+            return
+        # read only dictionaries are not bound to the instance
+        if isinstance(value, FrozenHStoreDict):
+            obj.__dict__[self.field.name] = value
+            return
         value = self.field.to_python(value)
         if isinstance(value, dict):
             value = self._DictClass(
@@ -46,7 +69,8 @@ class SerializedDictDescriptor(Creator):
         # Deserialization is only needed when retrieving data from DB
         # (not when field is being set via assignment (`x.data = {...}`)
         # or via the `.create()` method.
-        if value and self.field._from_db(obj):
+        # dictionaries retrieved from the database are deserialized on first access
+        if value and self.field._from_db(obj) and not isinstance(value, LazySerializedDict):
             value = self.field.to_python(value)
         obj.__dict__[self.field.name] = value
 
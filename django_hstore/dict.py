@@ -1,9 +1,11 @@
 import json
+import weakref
 
 from decimal import Decimal
 
 from django.utils import six
 from django.utils.encoding import force_text, force_str
+from django.utils.functional import empty
 
 from .compat import UnicodeMixin
 from . import utils, exceptions
@@ -12,6 +14,9 @@ from . import utils, exceptions
 __all__ = [
     'HStoreDict',
     'HStoreReferenceDict',
+    'PartialHStoreDict',
+    'FrozenHStoreDict',
+    'LazySerializedDict',
 ]
 
 
@@ -26,10 +31,24 @@ class HStoreDict(UnicodeMixin, dict):
     """
     A dictionary subclass which implements hstore support.
     """
-    schema_mode = False  # python2.6 compatibility
+    # one dictionary is built for each retrieved row, slots keep it small;
+    # the model instance is referenced weakly to avoid a reference cycle per row
+    __slots__ = (
+        'field',
+        'schema_mode',
+        '_instance',
+        # True until the dictionary built by ``from_db`` is bound to its model instance
+        '_from_db',
+        # True if changed and removed keys are being tracked, see ``track_changes``
+        '_tracking',
+        '_changed',
+        '_removed',
+        # values converted by the virtual fields in schema mode, keyed by hstore key
+        '_typed_values',
+    )
 
     def __init__(self, value=None, field=None, instance=None, schema_mode=False, **kwargs):
-        self.schema_mode = schema_mode
+        self._init_slots(field, instance, schema_mode)
 
         # if passed value is string
         # ensure is json formatted
@@ -43,6 +62,9 @@ class HStoreDict(UnicodeMixin, dict):
                 )
         elif value is None:
             value = {}
+        # values are normalized in place, read only dictionaries must be copied
+        elif isinstance(value, FrozenHStoreDict):
+            value = dict(value)
 
         # allow dictionaries only
         if not isinstance(value, dict):
@@ -51,13 +73,47 @@ class HStoreDict(UnicodeMixin, dict):
             )
 
         if not self.schema_mode:
-            # ensure values are acceptable
+            # ensure values are acceptable, strings are left as they are
             for key, val in value.items():
-                value[key] = self.ensure_acceptable_value(val)
+                # lazy references would be retrieved to check their type
+                if not isinstance(val, (utils.ReferenceProxy,) + six.string_types):
+                    value[key] = self.ensure_acceptable_value(val)
 
         super(HStoreDict, self).__init__(value, **kwargs)
+
+    def _init_slots(self, field=None, instance=None, schema_mode=False, from_db=False):
         self.field = field
         self.instance = instance
+        self.schema_mode = schema_mode
+        self._from_db = from_db
+        self._tracking = False
+        self._typed_values = None
+
+    @property
+    def instance(self):
+        instance = self._instance
+        return instance() if instance is not None else None
+
+    @instance.setter
+    def instance(self, instance):
+        self._instance = weakref.ref(instance) if instance is not None else None
+
+    @classmethod
+    def from_db(cls, value, field=None, schema_mode=False, interner=None):
+        """
+        Builds the dictionary from the value retrieved from the database,
+        values are already strings hence they are not normalized again;
+        keys and values are shared with other dictionaries if an interner is supplied
+        """
+        obj = cls.__new__(cls)
+        obj._init_slots(field, schema_mode=schema_mode, from_db=True)
+        if interner is None:
+            dict.update(obj, value)
+        else:
+            intern = interner.intern
+            for key, val in value.items():
+                dict.__setitem__(obj, intern(key), intern(val))
+        return obj
 
     def __setitem__(self, *args, **kwargs):
         """
@@ -68,6 +124,66 @@ class HStoreDict(UnicodeMixin, dict):
         # prepare *args
         args = (args[0], value)
         super(HStoreDict, self).__setitem__(*args, **kwargs)
+        if self._typed_values:
+            self._typed_values.pop(args[0], None)
+        if self._tracking:
+            self._changed.add(args[0])
+            self._removed.discard(args[0])
+
+    def __delitem__(self, key):
+        super(HStoreDict, self).__delitem__(key)
+        if self._typed_values:
+            self._typed_values.pop(key, None)
+        if self._tracking:
+            self._removed.add(key)
+            self._changed.discard(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        return super(HStoreDict, self).pop(key, *args)
+
+    def popitem(self):
+        key, value = super(HStoreDict, self).popitem()
+        if self._typed_values:
+            self._typed_values.pop(key, None)
+        if self._tracking:
+            self._removed.add(key)
+            self._changed.discard(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        if self._tracking:
+            self._removed.update(self.keys())
+            self._changed.clear()
+        self._typed_values = None
+        super(HStoreDict, self).clear()
+
+    def track_changes(self):
+        """
+        Starts tracking the keys which are changed or removed from now on,
+        which allows to save only the changes instead of the whole dictionary.
+        """
+        self._changed = set()
+        self._removed = set()
+        self._tracking = True
+
+    def get_changes(self):
+        """
+        Returns the changed key/value pairs and the removed keys since
+        ``track_changes`` has been called, or None if changes are not tracked.
+        """
+        if not self._tracking:
+            return None
+        changed = dict((key, dict.__getitem__(self, key)) for key in self._changed)
+        return changed, list(self._removed)
 
     def __getitem__(self, *args, **kwargs):
         """
@@ -76,10 +192,22 @@ class HStoreDict(UnicodeMixin, dict):
         value = super(HStoreDict, self).__getitem__(*args, **kwargs)
 
         if self.schema_mode:
+            key = args[0]
+            # converted values are cached until the key is changed
+            typed_values = self._typed_values
+            if typed_values is not None and key in typed_values:
+                return typed_values[key]
+            # dictionaries retrieved with values() are not bound to an instance
+            if self._instance is None:
+                return value
+            # the virtual fields belong to the model class, the instance isn't needed
             try:
-                return self.instance._hstore_virtual_fields[args[0]].to_python(value)
-            except KeyError:
-                pass
+                value = self.field.model._hstore_virtual_fields[key].to_python(value)
+            except (KeyError, AttributeError):
+                return value
+            if typed_values is None:
+                typed_values = self._typed_values = {}
+            typed_values[key] = value
 
         return value
 
@@ -98,8 +226,19 @@ class HStoreDict(UnicodeMixin, dict):
     def __unicode__(self):
         return force_text(json.dumps(self))
 
-    def __getstate__(self):
-        return self.__dict__
+    def __reduce__(self):
+        state = (self.field, self.instance, self.schema_mode, self._from_db,
+                 self.get_changes(), self._typed_values)
+        return _unpickle_hstore_dict, (self.__class__, dict(self)), state
+
+    def __setstate__(self, state):
+        field, instance, schema_mode, from_db, changes, typed_values = state
+        self._init_slots(field, instance, schema_mode, from_db)
+        if changes is not None:
+            self.track_changes()
+            self._changed.update(changes[0])
+            self._removed.update(changes[1])
+        self._typed_values = typed_values
 
     def __copy__(self):
         return self.__class__(self, self.field)
@@ -122,7 +261,10 @@ class HStoreDict(UnicodeMixin, dict):
             - convert to string
         """
         if not self.schema_mode:
-            if isinstance(value, bool):
+            # lazy references are left alone without retrieving them
+            if isinstance(value, utils.ReferenceProxy):
+                return value
+            elif isinstance(value, bool):
                 return force_text(value).lower()
             elif isinstance(value, six.integer_types + (float, Decimal)):
                 return force_text(value)
@@ -144,22 +286,338 @@ class HStoreDict(UnicodeMixin, dict):
         queryset.filter(pk=self.instance.pk).hremove(self.field.name, keys)
 
 
+def _unpickle_hstore_dict(cls, value):
+    # the values are already acceptable, the slots are restored by __setstate__
+    obj = cls.__new__(cls)
+    dict.update(obj, value)
+    return obj
+
+
 class HStoreReferenceDict(HStoreDict):
     """
     A dictionary which adds support to storing references to models
     """
+    __slots__ = ()
+
     def __getitem__(self, *args, **kwargs):
-        value = super(self.__class__, self).__getitem__(*args, **kwargs)
-        # if value is a string it needs to be converted to model instance
-        if isinstance(value, six.string_types):
-            reference = utils.acquire_reference(value)
-            self.__setitem__(args[0], reference)
-            return reference
+        value = super(HStoreReferenceDict, self).__getitem__(*args, **kwargs)
+        # if value is a string it needs to be converted to model instance,
+        # all the pending references are resolved at once to avoid N+1 queries
+        if utils.is_unresolved_reference(value):
+            if getattr(self.field, 'lazy', False):
+                utils.defer_references([self])
+            else:
+                self.resolve_all()
+            return super(HStoreReferenceDict, self).__getitem__(*args, **kwargs)
+        # resolved proxies are replaced with what they wrap, hence references
+        # to deleted rows are None as with eager references
+        if isinstance(value, utils.ReferenceProxy) and value._wrapped is not empty:
+            value = value._wrapped
+            dict.__setitem__(self, args[0], value)
         # otherwise just return the relation
         return value
 
+    def resolve_all(self):
+        """
+        Resolves all the references performing one query per referenced model.
+        """
+        utils.resolve_references([self])
+
     def get(self, key, default=None):
         try:
             return self.__getitem__(key)
         except KeyError:
             return default
+
+
+class PartialHStoreDict(HStoreDict):
+    """
+    A dictionary retrieved with ``HStoreQuerySet.only_keys`` which holds only some
+    of the keys stored in the database; the other keys are retrieved with one query
+    each when accessed, or all at once by ``load``. Saving a partial dictionary
+    updates only its changed and removed keys.
+    """
+    # keys whose presence is known, None once the whole dictionary is loaded;
+    # database alias and primary key of the row the dictionary has been retrieved from
+    __slots__ = ('_loaded_keys', '_source')
+
+    def _init_slots(self, *args, **kwargs):
+        super(PartialHStoreDict, self)._init_slots(*args, **kwargs)
+        self._loaded_keys = None
+        self._source = None
+
+    @classmethod
+    def from_db(cls, value, field=None, schema_mode=False, interner=None, keys=()):
+        obj = super(PartialHStoreDict, cls).from_db(value, field, schema_mode=schema_mode, interner=interner)
+        obj._loaded_keys = set(keys)
+        return obj
+
+    @property
+    def partial(self):
+        return self._loaded_keys is not None
+
+    def bind_source(self, instance):
+        """
+        Remembers the row of ``instance``, the keys which haven't been loaded
+        are retrieved from it even once the instance is garbage collected.
+        """
+        self._source = (instance._state.db, instance.pk)
+
+    def _get_queryset(self):
+        from .query import HStoreQuerySet
+        instance = self.instance
+        if instance is not None and instance.pk is not None:
+            self.bind_source(instance)
+        if self._source is None:
+            raise exceptions.HStoreDictException(
+                'PartialHStoreDict is not bound to a database row, '
+                'the keys which have not been retrieved can\'t be loaded'
+            )
+        using, pk = self._source
+        return HStoreQuerySet(self.field.model, using=using).filter(pk=pk)
+
+    def _load_key(self, key):
+        value = self._get_queryset().hslice(self.field.name, [key])
+        if key in value:
+            dict.__setitem__(self, key, value[key])
+        self._loaded_keys.add(key)
+
+    def load(self):
+        """
+        Retrieves the keys which haven't been loaded yet.
+        """
+        if self._loaded_keys is None:
+            return
+        values = list(self._get_queryset().values_list(self.field.name, flat=True))
+        for key, val in (values[0] if values and values[0] else {}).items():
+            if key not in self._loaded_keys:
+                dict.__setitem__(self, key, val)
+        self._loaded_keys = None
+
+    def __getitem__(self, key):
+        if self._loaded_keys is not None and key not in self._loaded_keys:
+            self._load_key(key)
+        return super(PartialHStoreDict, self).__getitem__(key)
+
+    def __contains__(self, key):
+        if self._loaded_keys is not None and key not in self._loaded_keys:
+            self._load_key(key)
+        return super(PartialHStoreDict, self).__contains__(key)
+
+    def __setitem__(self, key, value):
+        super(PartialHStoreDict, self).__setitem__(key, value)
+        if self._loaded_keys is not None:
+            self._loaded_keys.add(key)
+
+    def __delitem__(self, key):
+        if self._loaded_keys is not None and key not in self._loaded_keys:
+            self._load_key(key)
+        super(PartialHStoreDict, self).__delitem__(key)
+
+    def clear(self):
+        self.load()
+        super(PartialHStoreDict, self).clear()
+
+    def get_changes(self):
+        changes = super(PartialHStoreDict, self).get_changes()
+        if changes is None and self._loaded_keys is not None:
+            # the keys which haven't been loaded must not be overwritten
+            return dict(self), []
+        return changes
+
+    def __copy__(self):
+        # the copy stays partial, the keys which haven't been loaded must be preserved when saving it
+        obj = self.__class__.__new__(self.__class__)
+        obj._init_slots(self.field, schema_mode=self.schema_mode)
+        dict.update(obj, self)
+        obj._source = self._source
+        if self._loaded_keys is not None:
+            obj._loaded_keys = set(self._loaded_keys)
+            changed, removed = self.get_changes()
+            obj.track_changes()
+            obj._changed.update(changed)
+            obj._removed.update(removed)
+        return obj
+
+    def __reduce__(self):
+        function, args, state = super(PartialHStoreDict, self).__reduce__()
+        return function, args, (state, self._loaded_keys, self._source)
+
+    def __setstate__(self, state):
+        state, loaded_keys, source = state
+        super(PartialHStoreDict, self).__setstate__(state)
+        self._loaded_keys = loaded_keys
+        self._source = source
+
+
+class FrozenHStoreDict(UnicodeMixin, dict):
+    """
+    Immutable and hashable dictionary retrieved with ``HStoreQuerySet.hstore_readonly``,
+    it's not bound to any model instance, hence it can be shared between threads
+    and used as a cache key; values are the strings stored in the database.
+    """
+    __slots__ = ('_hash',)
+
+    @classmethod
+    def from_db(cls, value, interner=None):
+        if interner is None:
+            return cls(value)
+        intern = interner.intern
+        return cls((intern(key), intern(val)) for key, val in value.items())
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('%s is read only' % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __copy__(self):
+        # immutable, no need to copy it
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __unicode__(self):
+        return force_text(json.dumps(self))
+
+
+class LazySerializedDict(dict):
+    """
+    Dictionary of the serialized values retrieved from the database, each value
+    is deserialized on first access and then kept; all the values are
+    deserialized before being exposed together (eg: ``items()``, comparisons).
+    """
+    __slots__ = ('_loads', '_memo', '_pending')
+
+    def __init__(self, value, loads, memo=None):
+        super(LazySerializedDict, self).__init__(value)
+        self._loads = loads
+        # DeserializationMemo shared by the rows of a queryset, if any
+        self._memo = memo
+        # keys whose value is still serialized, None and dates are not
+        self._pending = set(key for key, value in dict.items(self) if isinstance(value, six.string_types))
+        # dict(), update() and ** read the storage of dict subclasses directly
+        # on python 2, hence the values can't be left serialized
+        if six.PY2:  # pragma no cover
+            self._load_all()
+
+    def _load(self, key):
+        if key in self._pending:
+            self._pending.discard(key)
+            value = dict.__getitem__(self, key)
+            if self._memo is not None:
+                value = self._memo.loads(value, self._loads)
+            else:
+                value = self._loads(value)
+            dict.__setitem__(self, key, value)
+
+    def _load_all(self):
+        for key in list(self._pending):
+            self._load(key)
+
+    def serialize(self, backend):
+        """
+        Returns the serialized dictionary, values which have not been accessed are
+        returned as they have been retrieved instead of being deserialized and serialized again
+        """
+        if backend.loads != self._loads:
+            self._load_all()
+        pending = self._pending
+        loaded = dict((key, value) for key, value in dict.items(self) if key not in pending)
+        serialized = backend.dumps_dict(loaded)
+        serialized.update((key, dict.__getitem__(self, key)) for key in pending)
+        return serialized
+
+    def __getitem__(self, key):
+        self._load(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._pending.discard(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        self._load(key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self._pending.clear()
+        dict.clear(self)
+
+    def __iter__(self):
+        # overridden so that dict(self) goes through __getitem__
+        return dict.__iter__(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    if six.PY2:  # pragma no cover
+        def itervalues(self):
+            self._load_all()
+            return dict.itervalues(self)
+
+        def iteritems(self):
+            self._load_all()
+            return dict.iteritems(self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        self._load_all()
+        if isinstance(other, LazySerializedDict):
+            other._load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
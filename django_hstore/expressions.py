@@ -0,0 +1,137 @@
+from __future__ import unicode_literals, absolute_import
+
+from decimal import Decimal
+from datetime import date, time, datetime
+
+from django.db.models import (BigIntegerField, BooleanField, DateField, DateTimeField, DecimalField, FloatField,
+                              IntegerField, TextField, TimeField)
+from django.db.models.expressions import Func, Value
+from django.utils import six
+
+from django_hstore.utils import get_cast_for_param
+
+
+__all__ = [
+    'HStoreKey',
+    'HStoreHasKey',
+    'HStoreSlice',
+    'HStoreAKeys',
+    'HStoreLen'
+]
+
+
+# python types of the output fields, used to look up the casts in ``get_cast_for_param``
+FIELD_TYPES = {
+    'AutoField': int,
+    'BigAutoField': int,
+    'IntegerField': int,
+    'BigIntegerField': int,
+    'SmallIntegerField': int,
+    'PositiveIntegerField': int,
+    'PositiveSmallIntegerField': int,
+    'FloatField': float,
+    'DecimalField': Decimal,
+    'BooleanField': bool,
+    'NullBooleanField': bool,
+    'DateField': date,
+    'DateTimeField': datetime,
+    'TimeField': time
+}
+
+# output fields of the python types
+OUTPUT_FIELDS = {
+    int: BigIntegerField,
+    float: FloatField,
+    Decimal: DecimalField,
+    bool: BooleanField,
+    date: DateField,
+    datetime: DateTimeField,
+    time: TimeField,
+    # values compared as stored
+    str: TextField,
+    six.text_type: TextField
+}
+
+
+def get_output_field(value_type):
+    """
+    Returns the output field of the values of ``value_type``, eg: ``BigIntegerField`` for ``int``.
+    """
+    for python_type in (bool, datetime) + tuple(OUTPUT_FIELDS):
+        if issubclass(value_type, python_type):
+            return OUTPUT_FIELDS[python_type]()
+    raise ValueError('unsupported type: %s' % value_type)
+
+
+class HStoreExpression(Func):
+    """
+    Base class of the hstore expressions, ``template`` is interpolated
+    with the sql of each source expression in order.
+    """
+    template = None
+
+    def as_sql(self, compiler, connection, **kwargs):
+        sql_parts, params = [], []
+        for expression in self.source_expressions:
+            sql, expression_params = compiler.compile(expression)
+            sql_parts.append(sql)
+            params.extend(expression_params)
+        return self.template % tuple(sql_parts), params
+
+
+class HStoreKey(HStoreExpression):
+    """
+    The value of ``key``, cast according to ``output_field``
+    (the value is returned as stored by default).
+    """
+    template = '(%s -> %s)'
+
+    def __init__(self, expression, key, output_field=None):
+        super(HStoreKey, self).__init__(expression, Value(key), output_field=output_field or TextField())
+
+    def as_sql(self, compiler, connection, **kwargs):
+        sql, params = super(HStoreKey, self).as_sql(compiler, connection, **kwargs)
+        value_type = FIELD_TYPES.get(self.output_field.get_internal_type())
+        cast = get_cast_for_param({None: value_type}, None) if value_type else ''
+        return '%s%s' % (sql, cast), params
+
+
+class HStoreHasKey(HStoreExpression):
+    """
+    Whether the hstore contains ``key``.
+    """
+    template = '(%s ? %s)'
+
+    def __init__(self, expression, key):
+        super(HStoreHasKey, self).__init__(expression, Value(key), output_field=BooleanField())
+
+
+class HStoreSlice(HStoreExpression):
+    """
+    The hstore restricted to ``keys``, converted by the hstore field.
+    """
+    template = 'slice(%s, %s)'
+
+    def __init__(self, expression, keys):
+        super(HStoreSlice, self).__init__(expression, Value(list(keys)))
+
+
+class HStoreAKeys(HStoreExpression):
+    """
+    The keys of the hstore as an array (requires ``django.contrib.postgres``).
+    """
+    template = 'akeys(%s)'
+
+    def __init__(self, expression):
+        from django.contrib.postgres.fields import ArrayField
+        super(HStoreAKeys, self).__init__(expression, output_field=ArrayField(TextField()))
+
+
+class HStoreLen(HStoreExpression):
+    """
+    The number of keys of the hstore.
+    """
+    template = 'coalesce(array_length(akeys(%s), 1), 0)'
+
+    def __init__(self, expression):
+        super(HStoreLen, self).__init__(expression, output_field=IntegerField())
@@ -2,20 +2,39 @@ from __future__ import absolute_import, unicode_literals
 
 import datetime
 import json
+import re
 
 import django
 from django.db import models
+from django.db.models.query_utils import QueryWrapper
+from django.db.models.signals import post_save
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
 from . import forms, utils
 from .descriptors import HStoreDescriptor, HStoreReferenceDescriptor, SerializedDictDescriptor
-from .dict import HStoreDict, HStoreReferenceDict
+from .dict import FrozenHStoreDict, HStoreDict, HStoreReferenceDict, LazySerializedDict, PartialHStoreDict
+from .serializers import CallableSerializer, CompressedSerializer, get_serializer
 from .virtual import create_hstore_virtual_field
 
 
 class HStoreField(models.Field):
     """ HStore Base Field """
+    read_modes = ('hstore', 'array')
+
+    def __init__(self, *args, **kwargs):
+        # if "array" values are selected as hstore_to_array(column),
+        # which is decoded by the driver much faster than the hstore text representation
+        self.read_mode = kwargs.pop('read_mode', 'hstore')
+        if self.read_mode not in self.read_modes:
+            raise ValueError('read_mode must be one of: %s' % ', '.join(self.read_modes))
+        super(HStoreField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(HStoreField, self).deconstruct()
+        if self.read_mode != 'hstore':
+            kwargs['read_mode'] = self.read_mode
+        return name, path, args, kwargs
 
     def __init_dict(self, value):
         """
@@ -31,6 +50,65 @@ class HStoreField(models.Field):
         super(HStoreField, self).contribute_to_class(cls, name)
         setattr(cls, self.name, HStoreDescriptor(self))
 
+    def select_format(self, compiler, sql, params):
+        keys = compiler.query.context.get('hstore_only_keys', {}).get(self)
+        if keys is not None and self._is_column(compiler, sql, params):
+            # only the keys specified with HStoreQuerySet.only_keys are retrieved
+            sql = 'slice(%s, %%s)' % sql
+            params = list(params) + [keys]
+        if self.read_mode == 'array':
+            sql = 'hstore_to_array(%s)' % sql
+        return super(HStoreField, self).select_format(compiler, sql, params)
+
+    def _is_column(self, compiler, sql, params):
+        """
+        Whether ``sql`` selects the column of the field, rather than an expression
+        whose output field is the hstore field (eg: an ``HStoreSlice`` annotation).
+        """
+        column = re.escape(compiler.connection.ops.quote_name(self.column))
+        return not params and re.match(r'^(?:"[^"]*"\.)?%s$' % column, sql) is not None
+
+    def from_db_value(self, value, expression, connection, context):
+        # in array read mode keys and values are retrieved as a flat array
+        if isinstance(value, list):
+            items = iter(value)
+            return dict(zip(items, items))
+        return value
+
+    def _track_changes(self, instance, update_fields=None, **kwargs):
+        """
+        once saved, the dictionary reflects the database value, changes are tracked from there
+        """
+        if update_fields is not None and self.name not in update_fields:
+            return
+        value = instance.__dict__.get(self.attname)
+        if isinstance(value, HStoreDict) and value.instance is instance:
+            value.track_changes()
+
+    def pre_save(self, model_instance, add):
+        """
+        if the dictionary tracks its changes, updates only the changed and removed keys
+        so that concurrent updates of other keys are not overwritten
+        """
+        value = super(HStoreField, self).pre_save(model_instance, add)
+        # instances which haven't been saved or loaded yet write the whole value,
+        # even when saved as an update because their primary key is set
+        if add or model_instance._state.adding or not isinstance(value, HStoreDict) or \
+                value.instance is not model_instance:
+            return value
+        changes = value.get_changes()
+        if changes is None:
+            return value
+        changed, removed = changes
+        sql, params = '"%s"' % self.column, []
+        if removed:
+            sql = 'delete(%s, %%s)' % sql
+            params.append(removed)
+        if changed:
+            sql = 'coalesce(%s, \'\'::hstore) || %%s' % sql
+            params.append(self.get_prep_value(changed))
+        return QueryWrapper(sql, params)
+
     def get_default(self):
         """
         Returns the default value for this field.
@@ -85,6 +163,20 @@ if django.VERSION >= (1, 7):
     HStoreField.register_lookup(HStoreIsNull)
 
 
+def track_changes(sender, instance, update_fields=None, **kwargs):
+    """
+    post_save receiver of all the models, connected once: proxy models and children of
+    multi-table inheritance are senders too, and the models built by migrations must not
+    register receivers of their own
+    """
+    for field in type(instance)._meta.concrete_fields:
+        if isinstance(field, HStoreField):
+            field._track_changes(instance, update_fields)
+
+
+post_save.connect(track_changes, dispatch_uid='django_hstore.fields.track_changes')
+
+
 class DictionaryField(HStoreField):
     description = _("A python dictionary in a postgresql hstore field.")
 
@@ -120,6 +212,20 @@ class DictionaryField(HStoreField):
         kwargs['form_class'] = forms.DictionaryField
         return super(DictionaryField, self).formfield(**kwargs)
 
+    def from_db_value(self, value, expression, connection, context):
+        value = super(DictionaryField, self).from_db_value(value, expression, connection, context)
+        # values() and values_list() return the dictionaries as retrieved
+        if value is None or utils.is_values_query(context):
+            return value
+        interner = utils.get_string_interner(context)
+        if context and context.get('hstore_readonly'):
+            return FrozenHStoreDict.from_db(value, interner=interner)
+        keys = context.get('hstore_only_keys', {}).get(self) if context else None
+        # expressions whose output field is the hstore field retrieve the whole value
+        if keys is not None and getattr(expression, 'target', None) is self:
+            return PartialHStoreDict.from_db(value, self, schema_mode=self.schema_mode, interner=interner, keys=keys)
+        return HStoreDict.from_db(value, self, schema_mode=self.schema_mode, interner=interner)
+
     def _value_to_python(self, value):
         return value
 
@@ -227,6 +333,21 @@ class DictionaryField(HStoreField):
 class ReferencesField(HStoreField):
     description = _("A python dictionary of references to model instances in an hstore field.")
 
+    def __init__(self, *args, **kwargs):
+        # if lazy references are returned as proxies which are resolved on first access
+        self.lazy = kwargs.pop('lazy', False)
+        # if compact references are stored as "app_label.ModelName:pk" (or "alias:pk")
+        self.compact = kwargs.pop('compact', False)
+        super(ReferencesField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(ReferencesField, self).deconstruct()
+        if self.lazy:
+            kwargs['lazy'] = True
+        if self.compact:
+            kwargs['compact'] = True
+        return name, path, args, kwargs
+
     def contribute_to_class(self, cls, name):
         super(ReferencesField, self).contribute_to_class(cls, name)
         setattr(cls, self.name, HStoreReferenceDescriptor(self))
@@ -237,11 +358,18 @@ class ReferencesField(HStoreField):
 
     def get_prep_lookup(self, lookup, value):
         if isinstance(value, dict):
-            return utils.serialize_references(value)
+            return utils.serialize_references(value, compact=self.compact)
         return value
 
     def get_prep_value(self, value):
-        return utils.serialize_references(value)
+        return utils.serialize_references(value, compact=self.compact)
+
+    def from_db_value(self, value, expression, connection, context):
+        value = super(ReferencesField, self).from_db_value(value, expression, connection, context)
+        # values() and values_list() return the references as strings
+        if value is None or utils.is_values_query(context):
+            return value
+        return HStoreReferenceDict.from_db(value, self, interner=utils.get_string_interner(context))
 
     def to_python(self, value):
         return value if isinstance(value, dict) else HStoreReferenceDict({})
@@ -254,10 +382,37 @@ class SerializedDictionaryField(HStoreField):
     description = _("A python dictionary in a postgresql hstore field.")
 
     def __init__(self, serializer=json.dumps, deserializer=json.loads, *args, **kwargs):
-        self.serializer = serializer
-        self.deserializer = deserializer
+        # serializer can be the name of a backend, see django_hstore.serializers
+        self.serializer_name = serializer if isinstance(serializer, six.string_types) else None
+        if self.serializer_name is not None:
+            self.backend = get_serializer(serializer)
+        elif serializer is json.dumps and deserializer is json.loads:
+            self.backend = get_serializer()
+        else:
+            self.backend = CallableSerializer(serializer, deserializer)
+        # values longer than compress_threshold characters are stored compressed
+        self.compress_threshold = kwargs.pop('compress_threshold', None)
+        if self.compress_threshold is not None:
+            self.backend = CompressedSerializer(self.backend, self.compress_threshold)
+        self.serializer = self.backend.dumps
+        self.deserializer = self.backend.loads
         super(SerializedDictionaryField, self).__init__(*args, **kwargs)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super(SerializedDictionaryField, self).deconstruct()
+        if self.serializer_name is not None:
+            kwargs['serializer'] = self.serializer_name
+        if self.compress_threshold is not None:
+            kwargs['compress_threshold'] = self.compress_threshold
+        return name, path, args, kwargs
+
+    @property
+    def compression_stats(self):
+        """
+        CompressionStats of the field, None if compression is not enabled.
+        """
+        return getattr(self.backend, 'stats', None)
+
     def _from_db(self, model_instance):
         """
         Helper to determine if model instance is from the DB.
@@ -292,7 +447,9 @@ class SerializedDictionaryField(HStoreField):
     def _serialize_dict(self, value):
         if value is None:
             return value
-        return dict((k, self._serialize_value(v)) for k, v in value.items())
+        if isinstance(value, LazySerializedDict):
+            return value.serialize(self.backend)
+        return self.backend.dumps_dict(value)
 
     def _deserialize_value(self, value):
         if value is None or isinstance(value, datetime.date):
@@ -305,14 +462,21 @@ class SerializedDictionaryField(HStoreField):
 
     def _deserialize_dict(self, value):
         """ Helper to deserialize dict-like data """
-        if not value or isinstance(value, six.string_types):
+        if not value or isinstance(value, (six.string_types, LazySerializedDict)):
             return value
-        return dict((k, self._deserialize_value(v)) for k, v in value.items())
+        return self.backend.loads_dict(value)
 
     def contribute_to_class(self, cls, name):
         super(SerializedDictionaryField, self).contribute_to_class(cls, name)
         setattr(cls, self.name, SerializedDictDescriptor(self))
 
+    def from_db_value(self, value, expression, connection, context):
+        value = super(SerializedDictionaryField, self).from_db_value(value, expression, connection, context)
+        if not isinstance(value, dict) or utils.is_values_query(context):
+            return value
+        # values are deserialized on first access
+        return LazySerializedDict(value, self.deserializer, context.get('hstore_memo') if context else None)
+
     def formfield(self, **kwargs):
         kwargs['form_class'] = forms.SerializedDictionaryField
         return super(SerializedDictionaryField, self).formfield(**kwargs)
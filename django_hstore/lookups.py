@@ -31,8 +31,22 @@ class HStoreLookupMixin(object):
         # We need to record the types of the rhs parameters before they are converted to strings
         if isinstance(rhs, dict):
             self.value_annot = get_value_annotations(rhs)
+            self.value = rhs
         super(HStoreLookupMixin, self).__init__(lhs, rhs)
 
+    def get_key_cast(self, key):
+        """
+        Returns the cast of the hstore value of ``key`` and of its parameter;
+        lists and dictionaries of serialized fields are compared as jsonb,
+        strings are compared as text since the stored values might not be valid json.
+        """
+        cast = get_cast_for_param(self.value_annot, key)
+        value_type = self.value_annot.get(key)
+        if not cast and isinstance(value_type, type) and issubclass(value_type, (list, tuple, dict)) and \
+                getattr(getattr(self.lhs.target, 'backend', None), 'is_json', False):
+            return '::jsonb', '::jsonb'
+        return cast, ''
+
 
 class HStoreComparisonLookupMixin(HStoreLookupMixin):
     """
@@ -49,8 +63,8 @@ class HStoreComparisonLookupMixin(HStoreLookupMixin):
             conditions = []
 
             for key in param_keys:
-                cast = get_cast_for_param(self.value_annot, key)
-                conditions.append('(%s->\'%s\')%s %s %%s' % (lhs, key, cast, sign))
+                cast, param_cast = self.get_key_cast(key)
+                conditions.append('(%s->\'%s\')%s %s %%s%s' % (lhs, key, cast, sign, param_cast))
 
             return (" AND ".join(conditions), param.values())
 
@@ -83,6 +97,12 @@ class HStoreContains(HStoreLookupMixin, Contains):
             lhs = '{0}{1}'.format(lhs[:-4], 'hstore')
         param = self.rhs
 
+        from django_hstore.fields import ReferencesField
+        if isinstance(param, dict) and (hasattr(self.lhs.target, 'serializer') or
+                                        isinstance(self.lhs.target, ReferencesField)):
+            # depending on the django version the rhs might not have been serialized yet
+            # (nor the model instances turned into references)
+            param = self.lhs.target.get_prep_value(self.value)
         if isinstance(param, dict):
             values = list(param.values())
             keys = list(param.keys())
@@ -91,8 +111,8 @@ class HStoreContains(HStoreLookupMixin, Contains):
                 return '%s->\'%s\' = ANY(%%s)' % (lhs, keys[0]), [[str(x) for x in values[0]]]
             elif len(keys) == 1 and len(values) == 1:
                 # Retrieve key and compare to param instead of using '@>' in order to cast hstore value
-                cast = get_cast_for_param(self.value_annot, keys[0])
-                return ('(%s->\'%s\')%s = %%s' % (lhs, keys[0], cast), [values[0]])
+                cast, param_cast = self.get_key_cast(keys[0])
+                return ('(%s->\'%s\')%s = %%s%s' % (lhs, keys[0], cast, param_cast), [values[0]])
             return '%s @> %%s' % lhs, [param]
         elif isinstance(param, (list, tuple)):
             if len(param) == 0:
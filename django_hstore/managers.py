@@ -17,8 +17,8 @@ class HStoreManager(models.Manager):
 
     get_query_set = get_queryset
 
-    def hkeys(self, attr, **params):
-        return self.filter(**params).hkeys(attr)
+    def hkeys(self, attr, distinct=False, counts=False, sample=None, iterator=False, **params):
+        return self.filter(**params).hkeys(attr, distinct, counts, sample, iterator)
 
     def hpeek(self, attr, key, **params):
         return self.filter(**params).hpeek(attr, key)
@@ -26,6 +26,30 @@ class HStoreManager(models.Manager):
     def hslice(self, attr, keys, **params):
         return self.filter(**params).hslice(attr, keys)
 
+    def hvalues_list(self, attr, keys, flat=False, cast=None):
+        return self.get_queryset().hvalues_list(attr, keys, flat, cast)
+
+    def haggregate(self, attr, aggregates, group_by=None):
+        return self.get_queryset().haggregate(attr, aggregates, group_by)
+
+    def hrows(self, *fields, **kwargs):
+        return self.get_queryset().hrows(*fields, **kwargs)
+
+    def only_keys(self, attr, keys):
+        return self.get_queryset().only_keys(attr, keys)
+
+    def prefetch_references(self, *attrs):
+        return self.get_queryset().prefetch_references(*attrs)
+
+    def intern_strings(self, maxsize=10000):
+        return self.get_queryset().intern_strings(maxsize)
+
+    def hstore_readonly(self):
+        return self.get_queryset().hstore_readonly()
+
+    def memoize_values(self, maxsize=10000):
+        return self.get_queryset().memoize_values(maxsize)
+
 
 if GEODJANGO_INSTALLED:
     from django.contrib.gis.db import models as geo_models
@@ -1,10 +1,13 @@
 from __future__ import absolute_import, unicode_literals
 
+from collections import OrderedDict, namedtuple
+from itertools import islice
+
 import django
-from django.db import transaction
+from django.db import connections, transaction
 from django.db.models.query import QuerySet
 from django.db.models.query_utils import QueryWrapper
-from django.db.models.sql.constants import SINGLE
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE, SINGLE
 from django.db.models.sql.datastructures import EmptyResultSet
 from django.db.models.sql.query import Query
 from django.db.models.sql.subqueries import UpdateQuery
@@ -12,7 +15,12 @@ from django.db.models.sql.where import WhereNode
 from django.utils import six
 
 from django_hstore.apps import GEODJANGO_INSTALLED
-from django_hstore.utils import get_cast_for_param, get_value_annotations
+from django_hstore.dict import HStoreReferenceDict, PartialHStoreDict
+from django_hstore.expressions import HStoreKey, get_output_field
+from django_hstore.fields import DictionaryField, HStoreField, ReferencesField
+from django_hstore.serializers import DeserializationMemo
+from django_hstore.utils import (StringInterner, defer_references, get_cast_for_param, get_value_annotations,
+                                 is_values_query, resolve_references)
 
 try:
     # django <= 1.8
@@ -164,15 +172,220 @@ class HStoreQuerySet(QuerySet):
     def __init__(self, model=None, query=None, using=None, *args, **kwargs):
         query = query or HStoreQuery(model)
         super(HStoreQuerySet, self).__init__(model=model, query=query, using=using, *args, **kwargs)
+        self._prefetch_references = ()
+
+    def _clone(self, *args, **kwargs):
+        clone = super(HStoreQuerySet, self)._clone(*args, **kwargs)
+        clone._prefetch_references = self._prefetch_references
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._prefetch_references:
+            # the whole result set is loaded in memory anyway,
+            # hence references are resolved all at once instead of in chunks
+            prefetch, self._prefetch_references = self._prefetch_references, ()
+            try:
+                self._result_cache = list(self.iterator())
+            finally:
+                self._prefetch_references = prefetch
+            self._resolve_prefetched_references(self._result_cache)
+        super(HStoreQuerySet, self)._fetch_all()
+
+    def iterator(self):
+        maxsize = self.query.context.get('hstore_memo_size')
+        if maxsize:
+            # the memo is scoped to a single evaluation
+            self.query.add_context('hstore_memo', DeserializationMemo(maxsize))
+        iterator = super(HStoreQuerySet, self).iterator()
+        only_keys = self.query.context.get('hstore_only_keys')
+        if only_keys and not is_values_query(self.query.context):
+            iterator = self._iterate_binding_partial_dictionaries(iterator, only_keys)
+        if self._prefetch_references:
+            return self._iterate_prefetching_references(iterator)
+        return iterator
+
+    def _iterate_binding_partial_dictionaries(self, iterator, only_keys):
+        attnames = [field.attname for field in only_keys]
+        for obj in iterator:
+            for attname in attnames:
+                value = obj.__dict__.get(attname)
+                if isinstance(value, PartialHStoreDict):
+                    value.bind_source(obj)
+            yield obj
+
+    def _iterate_prefetching_references(self, iterator):
+        while True:
+            chunk = list(islice(iterator, GET_ITERATOR_CHUNK_SIZE))
+            if not chunk:
+                return
+            self._resolve_prefetched_references(chunk)
+            for obj in chunk:
+                yield obj
+
+    def _resolve_prefetched_references(self, objects):
+        dictionaries, lazy_dictionaries = [], []
+        for attr in self._prefetch_references:
+            target = lazy_dictionaries if get_field(self, attr).lazy else dictionaries
+            for obj in objects:
+                value = getattr(obj, attr, None)
+                if isinstance(value, HStoreReferenceDict):
+                    target.append(value)
+        resolve_references(dictionaries)
+        # lazy references share the same batch, which is resolved on first access
+        defer_references(lazy_dictionaries)
+
+    def values(self, *args, **kwargs):
+        clone = super(HStoreQuerySet, self).values(*args, **kwargs)
+        # the hstore fields return the dictionaries as retrieved instead of the ones bound to instances
+        clone.query.add_context('hstore_values', True)
+        return clone
+
+    def values_list(self, *args, **kwargs):
+        clone = super(HStoreQuerySet, self).values_list(*args, **kwargs)
+        clone.query.add_context('hstore_values', True)
+        return clone
+
+    def intern_strings(self, maxsize=10000):
+        """
+        Shares the identical keys and values of the hstore dictionaries
+        across all the rows retrieved by the queryset.
+        """
+        clone = self._clone()
+        clone.query.add_context('hstore_interner', StringInterner(maxsize))
+        return clone
+
+    def memoize_values(self, maxsize=10000):
+        """
+        Deserializes only once the identical values of the SerializedDictionaryFields
+        retrieved by each evaluation of the queryset.
+        """
+        clone = self._clone()
+        clone.query.add_context('hstore_memo_size', maxsize)
+        return clone
+
+    def hstore_readonly(self):
+        """
+        Retrieves the DictionaryFields as immutable and hashable dictionaries
+        (``FrozenHStoreDict``) which are cheaper to build.
+        """
+        clone = self._clone()
+        clone.query.add_context('hstore_readonly', True)
+        return clone
+
+    def only_keys(self, attr, keys):
+        """
+        Retrieves only the specified keys of the DictionaryField ``attr``,
+        the other keys are retrieved when accessed (see ``PartialHStoreDict``).
+        """
+        field = get_field(self, attr)
+        if not isinstance(field, DictionaryField):
+            raise ValueError('%s is not a DictionaryField' % attr)
+        clone = self._clone()
+        # the context is shared with the queryset which has been cloned
+        only_keys = dict(clone.query.context.get('hstore_only_keys', {}))
+        only_keys[field] = list(keys)
+        clone.query.add_context('hstore_only_keys', only_keys)
+        return clone
+
+    def prefetch_references(self, *attrs):
+        """
+        Resolves the references of the specified ReferencesFields across all
+        the rows of the queryset, performing one query per referenced model.
+        """
+        clone = self._clone()
+        if attrs == (None,):
+            clone._prefetch_references = ()
+            return clone
+        for attr in attrs:
+            if not isinstance(get_field(self, attr), ReferencesField):
+                raise ValueError('%s is not a ReferencesField' % attr)
+        clone._prefetch_references = clone._prefetch_references + attrs
+        return clone
 
     @select_query
-    def hkeys(self, query, attr):
+    def hkeys(self, query, attr, distinct=False, counts=False, sample=None, iterator=False):
         """
-        Enumerates the keys in the specified hstore.
+        Enumerates the keys in the specified hstore of the first row; with ``distinct``
+        enumerates the keys of all the rows (sorted), ``counts`` returns the number of rows
+        having each key, ``sample`` scans only the specified percentage of the table (and
+        implies ``distinct``) and ``iterator`` returns an iterator instead of a list
+        (or an ordered dictionary).
         """
-        query.add_extra({'_': 'akeys("%s")' % attr}, None, None, None, None, None)
-        result = query.get_compiler(self.db).execute_sql(SINGLE)
-        return (result[0] if result else [])
+        if sample is not None:
+            sample = float(sample)
+            if not 0 < sample <= 100:
+                raise ValueError('sample must be a percentage')
+        elif not (distinct or counts):
+            query.add_extra({'_': 'akeys("%s")' % attr}, None, None, None, None, None)
+            result = query.get_compiler(self.db).execute_sql(SINGLE)
+            keys = result[0] if result else []
+            return iter(keys) if iterator else keys
+        field = get_field(self, attr)
+        if not isinstance(field, HStoreField):
+            raise ValueError('%s is not an hstore field' % attr)
+        sql, params = self._hkeys_sql(query, field, sample)
+        if counts:
+            sql = sql and 'SELECT key, COUNT(*) FROM (%s) AS hkeys(key) GROUP BY key ORDER BY key' % sql
+            rows = self._hkeys_rows(sql, params)
+            return (tuple(row) for row in rows) if iterator else OrderedDict(rows)
+        sql = sql and 'SELECT DISTINCT key FROM (%s) AS hkeys(key) ORDER BY key' % sql
+        rows = (row[0] for row in self._hkeys_rows(sql, params))
+        return rows if iterator else list(rows)
+
+    def _hkeys_sql(self, query, field, sample):
+        """
+        Returns the statement selecting the keys of ``field`` in the rows of ``query``,
+        the table of the model is sampled if ``sample`` is specified.
+        """
+        compiler = query.get_compiler(self.db)
+        # joins the table of the parent model declaring the field if needed
+        column, params = compiler.compile(query.resolve_ref(field.name))
+        sliced = query.low_mark or query.high_mark is not None
+        if sliced:
+            # the rows of a sliced queryset are taken in its order
+            compiler.setup_query()
+            order_by = compiler.get_order_by()
+        from_, from_params = compiler.get_from_clause()
+        params = list(params)
+        if sample is not None:
+            # the first entry is the table of the model, the joins follow
+            from_[0] = '%s TABLESAMPLE SYSTEM (%%s)' % from_[0]
+            params.append(sample)
+        params.extend(from_params)
+        try:
+            where, where_params = compiler.compile(query.where)
+        except EmptyResultSet:
+            return None, []
+        sql = 'SELECT %s AS value FROM %s' % (column, ' '.join(from_))
+        if where:
+            sql = '%s WHERE %s' % (sql, where)
+            params.extend(where_params)
+        # the slice of the queryset limits the rows, not the keys
+        if sliced and order_by:
+            ordering = []
+            for _, (order_sql, order_params, _) in order_by:
+                ordering.append(order_sql)
+                params.extend(order_params)
+            sql = '%s ORDER BY %s' % (sql, ', '.join(ordering))
+        if query.high_mark is not None:
+            sql = '%s LIMIT %d' % (sql, query.high_mark - query.low_mark)
+        if query.low_mark:
+            sql = '%s OFFSET %d' % (sql, query.low_mark)
+        return 'SELECT skeys(value) FROM (%s) AS hkeys_rows' % sql, params
+
+    def _hkeys_rows(self, sql, params):
+        if not sql:
+            return
+        connection = connections[self.db]
+        # server side cursors are available since django 1.11
+        cursor = connection.chunked_cursor() if hasattr(connection, 'chunked_cursor') else connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            for rows in iter(lambda: cursor.fetchmany(GET_ITERATOR_CHUNK_SIZE), []):
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
 
     @select_query
     def hpeek(self, query, attr, key):
@@ -198,6 +411,99 @@ class HStoreQuerySet(QuerySet):
             return dict((key, field._value_to_python(value)) for key, value in result[0].items())
         return {}
 
+    def hrows(self, *fields, **kwargs):
+        """
+        Returns an iterator of lightweight rows (namedtuples) with the specified fields
+        and the values of the hstore keys specified with ``keys={attr: [key, ...]}``,
+        which are extracted by the database and cast if the types are specified
+        with ``keys={attr: {key: type}}``.
+        """
+        keys = kwargs.pop('keys', None) or {}
+        if kwargs:
+            raise TypeError('unexpected keyword arguments: %s' % ', '.join(kwargs))
+        if not fields and not keys:
+            fields = [field.attname for field in self.model._meta.concrete_fields]
+        names, selected = list(fields), list(fields)
+        annotations = {}
+        for attr, attr_keys in keys.items():
+            if not isinstance(attr_keys, dict):
+                attr_keys = OrderedDict((key, None) for key in attr_keys)
+            for key, value_type in attr_keys.items():
+                if key in names:
+                    raise ValueError('duplicate name %s in hrows' % key)
+                # the keys may clash with the names of the model fields
+                alias = '_hrow%d' % len(annotations)
+                annotations[alias] = self._hstore_key_select(attr, key, value_type)
+                names.append(key)
+                selected.append(alias)
+        queryset = self.annotate(**annotations).values_list(*selected)
+        Row = namedtuple('Row', names, rename=True)
+        return (Row._make(values) for values in queryset.iterator())
+
+    def hvalues_list(self, attr, keys, flat=False, cast=None):
+        """
+        Returns an iterator of the values of the specified keys of each row (tuples, or single
+        values with ``flat``), which are extracted by the database; the values are converted
+        by the field unless they are cast by the database as specified by ``cast``
+        (a type, or a dictionary of types by key).
+        """
+        if isinstance(keys, six.string_types):
+            keys = [keys]
+        if not keys:
+            raise ValueError('no keys specified')
+        if flat and len(keys) > 1:
+            raise TypeError("'flat' is not valid when hvalues_list is called with more than one key")
+        field = get_field(self, attr)
+        annotations, selected, converters = {}, [], []
+        for index, key in enumerate(keys):
+            value_type = cast.get(key) if isinstance(cast, dict) else cast
+            alias = '_hvalue%d' % index
+            annotations[alias] = self._hstore_key_select(attr, key, value_type)
+            selected.append(alias)
+            converters.append(field._value_to_python if value_type is None else None)
+        queryset = self.annotate(**annotations).values_list(*selected)
+        rows = queryset.iterator()
+        if not any(converters):
+            return (row[0] for row in rows) if flat else rows
+        if flat:
+            convert = converters[0]
+            return (convert(row[0]) if row[0] is not None else None for row in rows)
+        return (tuple(convert(value) if convert and value is not None else value
+                      for convert, value in zip(converters, row)) for row in rows)
+
+    def haggregate(self, attr, aggregates, group_by=None):
+        """
+        Aggregates the values of the keys of the specified hstore in a single query,
+        ``aggregates`` maps the names of the results to the aggregates of
+        ``django_hstore.aggregates``; with ``group_by`` returns an ordered dictionary
+        of the results keyed by the values of the ``group_by`` key.
+        """
+        field = get_field(self, attr)
+        if not isinstance(field, HStoreField):
+            raise ValueError('%s is not an hstore field' % attr)
+        expressions = dict((name, aggregate.get_expression(attr)) for name, aggregate in aggregates.items())
+        if group_by is None:
+            return self.aggregate(**expressions)
+        queryset = self.annotate(_hstore_group=HStoreKey(attr, group_by)).order_by().values('_hstore_group')
+        rows = queryset.annotate(**expressions).order_by('_hstore_group')
+        return OrderedDict((row.pop('_hstore_group'), row) for row in rows)
+
+    def _hstore_key_select(self, attr, key, value_type=None):
+        """
+        Returns the expression which selects the value of ``key`` cast as specified
+        by ``value_type`` (see ``get_cast_for_param``), the column is resolved by the
+        query hence the table of the parent model declaring the field is joined if needed.
+        """
+        field = get_field(self, attr)
+        if not isinstance(field, HStoreField):
+            raise ValueError('%s is not an hstore field' % attr)
+        try:
+            output_field = get_output_field(value_type) if value_type is not None else None
+        except ValueError:
+            # the values of the other types are returned as stored
+            output_field = None
+        return HStoreKey(attr, key, output_field=output_field)
+
     @update_query
     def hremove(self, query, attr, keys):
         """
@@ -214,8 +520,8 @@ class HStoreQuerySet(QuerySet):
         Updates the specified hstore.
         """
         field = get_field(self, attr)
-        if hasattr(field, 'serializer'):
-            updates = field.get_prep_value(updates)
+        # values are normalized (or serialized) as when saving the whole dictionary
+        updates = field.get_prep_value(updates)
         value = QueryWrapper('"%s" || %%s' % attr, [updates])
         query.add_update_fields([(field, None, value)])
         return query
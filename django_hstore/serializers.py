@@ -0,0 +1,277 @@
+from __future__ import unicode_literals, absolute_import
+
+import base64
+import datetime
+import json
+import time
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+
+__all__ = [
+    'Serializer',
+    'JSONSerializer',
+    'OrjsonSerializer',
+    'UJSONSerializer',
+    'MsgpackSerializer',
+    'CallableSerializer',
+    'CompressedSerializer',
+    'CompressionStats',
+    'DeserializationMemo',
+    'register_serializer',
+    'get_serializer'
+]
+
+
+class Serializer(object):
+    """
+    Base class of the serializer backends of ``SerializedDictionaryField``,
+    each value of the dictionary is encoded to a string; None and dates are
+    left alone because postgresql can handle them; ``is_json`` tells the lookups
+    whether the stored values can be compared as jsonb.
+    """
+    name = None
+    is_json = False
+
+    def dumps(self, value):
+        raise NotImplementedError()
+
+    def loads(self, value):
+        raise NotImplementedError()
+
+    def dumps_dict(self, value):
+        """
+        Serializes all the values of a dictionary at once.
+        """
+        dumps = self.dumps
+        return dict((key, val if val is None or isinstance(val, datetime.date) else dumps(val))
+                    for key, val in value.items())
+
+    def loads_dict(self, value):
+        """
+        Deserializes all the values of a dictionary at once.
+        """
+        loads = self.loads
+        return dict((key, loads(val) if isinstance(val, six.string_types) else val)
+                    for key, val in value.items())
+
+
+class JSONSerializer(Serializer):
+    """
+    Standard library json, encoder and decoder instances are reused.
+    """
+    name = 'json'
+    is_json = True
+
+    def __init__(self):
+        self.dumps = json.JSONEncoder().encode
+        self.loads = json.JSONDecoder().decode
+
+
+class OrjsonSerializer(Serializer):
+    name = 'orjson'
+    is_json = True
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self.loads = orjson.loads
+
+    def dumps(self, value):
+        return self._dumps(value).decode('utf-8')
+
+
+class UJSONSerializer(Serializer):
+    name = 'ujson'
+    is_json = True
+
+    def __init__(self):
+        import ujson
+        self.dumps = ujson.dumps
+        self.loads = ujson.loads
+
+
+class MsgpackSerializer(Serializer):
+    """
+    msgpack encoded values, stored in base64 because hstore values are text;
+    not compatible with the data stored by the json based serializers.
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def dumps(self, value):
+        return base64.b64encode(self._packb(value, use_bin_type=True)).decode('ascii')
+
+    def loads(self, value):
+        return self._unpackb(base64.b64decode(value), raw=False)
+
+
+class CallableSerializer(Serializer):
+    """
+    Wraps the ``serializer`` and ``deserializer`` callables supplied to the field.
+    """
+    def __init__(self, dumps, loads):
+        self.dumps = dumps
+        self.loads = loads
+
+
+class CompressionStats(object):
+    """
+    Statistics of the values compressed and decompressed by a ``CompressedSerializer``.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.compressed = 0
+        self.original_size = 0
+        self.compressed_size = 0
+        self.compress_time = 0.0
+        self.decompressed = 0
+        self.decompress_time = 0.0
+
+    @property
+    def ratio(self):
+        """
+        Compressed size of the compressed values relative to their original size.
+        """
+        if not self.original_size:
+            return None
+        return float(self.compressed_size) / self.original_size
+
+
+class CompressedSerializer(Serializer):
+    """
+    Wraps a serializer, serialized values longer than ``threshold`` characters
+    are compressed with zlib and stored in base64 with the "zlib:" prefix.
+    """
+    prefix = 'zlib:'
+
+    def __init__(self, serializer, threshold):
+        self.serializer = serializer
+        self.threshold = threshold
+        self.stats = CompressionStats()
+
+    def dumps(self, value):
+        value = self.serializer.dumps(value)
+        if len(value) <= self.threshold:
+            return value
+        start = time.time()
+        compressed = self.prefix + base64.b64encode(zlib.compress(value.encode('utf-8'))).decode('ascii')
+        stats = self.stats
+        stats.compress_time += time.time() - start
+        stats.compressed += 1
+        stats.original_size += len(value)
+        stats.compressed_size += len(compressed)
+        return compressed
+
+    def loads(self, value):
+        if value.startswith(self.prefix):
+            start = time.time()
+            value = zlib.decompress(base64.b64decode(value[len(self.prefix):])).decode('utf-8')
+            self.stats.decompress_time += time.time() - start
+            self.stats.decompressed += 1
+        return self.serializer.loads(value)
+
+
+class DeserializationMemo(object):
+    """
+    Bounded memo of deserialized values keyed by their serialized string,
+    used for a single evaluation of a queryset (see ``HStoreQuerySet.memoize_values``);
+    mutable values (lists and dictionaries) are copied each time they are reused.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.size = 0
+        # one table for each deserializer
+        self.tables = {}
+
+    def loads(self, value, loads):
+        table = self.tables.get(loads)
+        if table is None:
+            table = self.tables[loads] = {}
+        try:
+            result, copy = table[value]
+        except KeyError:
+            result = loads(value)
+            if self.size >= self.maxsize:
+                return result
+            self.size += 1
+            copy = _get_copy_function(result, loads)
+            if copy is loads:
+                # nested values are cheaper to deserialize again than to copy,
+                # hence the serialized string is kept instead
+                table[value] = (value, loads)
+                return result
+            table[value] = (result, copy)
+        return copy(result) if copy is not None else result
+
+
+def _is_mutable(value):
+    return isinstance(value, (list, dict))
+
+
+def _get_copy_function(value, loads):
+    """
+    Returns the function which copies a deserialized value, None if immutable;
+    flat lists and dictionaries are copied, nested ones are deserialized again with ``loads``.
+    """
+    if isinstance(value, list):
+        return loads if any(_is_mutable(item) for item in value) else list
+    if isinstance(value, dict):
+        return loads if any(_is_mutable(item) for item in value.values()) else dict
+    return None
+
+
+_serializer_classes = {}
+_serializers = {}
+
+
+def register_serializer(serializer_class, name=None):
+    """
+    Registers a serializer backend, which can then be selected by name
+    with the ``serializer`` option of the field or ``DJANGO_HSTORE_SERIALIZER``.
+    """
+    name = name or serializer_class.name
+    _serializer_classes[name] = serializer_class
+    _serializers.pop(name, None)
+
+
+for serializer_class in (JSONSerializer, OrjsonSerializer, UJSONSerializer, MsgpackSerializer):
+    register_serializer(serializer_class)
+
+
+def get_serializer(name=None):
+    """
+    Returns the serializer backend registered as ``name``, defaults to
+    ``DJANGO_HSTORE_SERIALIZER``; "fastest" picks the fastest installed json library.
+    """
+    if name is None:
+        name = getattr(settings, 'DJANGO_HSTORE_SERIALIZER', 'json')
+    if name == 'fastest':
+        for name in ('orjson', 'ujson', 'json'):
+            try:
+                return get_serializer(name)
+            except ImproperlyConfigured:
+                pass
+    try:
+        return _serializers[name]
+    except KeyError:
+        pass
+    try:
+        serializer_class = _serializer_classes[name]
+    except KeyError:
+        raise ImproperlyConfigured('unknown hstore serializer: %s' % name)
+    try:
+        serializer = serializer_class()
+    except ImportError as e:
+        raise ImproperlyConfigured('hstore serializer %s is not available: %s' % (name, e))
+    _serializers[name] = serializer
+    return serializer
@@ -1,30 +1,308 @@
 from __future__ import unicode_literals, absolute_import
 
+import copy
 from decimal import Decimal
 from datetime import date, time, datetime
 
+from django.apps import apps
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.functional import LazyObject, empty
+
+from .cache import get_reference_cache
+
+
+# caches the model classes of references, keyed by their path
+_reference_models = {}
+# querysets used to retrieve the referenced instances, keyed by model
+_reference_querysets = {}
+# short aliases used by the compact representation of references, keyed by model
+_reference_aliases = {}
+
+
+def get_reference_model(path):
+    """
+    Returns the model class of the specified path, which can be either
+    the full python path of the model or its "app_label.ModelName" label;
+    model classes are cached until the app registry changes
+    """
+    try:
+        return _reference_models[path]
+    except KeyError:
+        pass
+    model = None
+    if path.count('.') == 1:
+        try:
+            model = apps.get_model(path)
+        except LookupError:
+            pass
+    if model is None:
+        module, sep, attr = path.rpartition('.')
+        model = getattr(__import__(module, fromlist=(attr,)), attr)
+    _reference_models[path] = model
+    return model
+
+
+def clear_reference_cache(**kwargs):
+    """
+    Clears the model classes cached by ``get_reference_model``,
+    connected to the ``class_prepared`` signal
+    """
+    _reference_models.clear()
+    # registered aliases are not part of the cache
+    for model, alias in _reference_aliases.items():
+        _reference_models[alias] = model
+
+
+def register_reference_queryset(model, queryset=None, only=None):
+    """
+    Registers the queryset used to retrieve the referenced instances of ``model``,
+    ``only`` restricts the loaded fields to the specified ones
+    """
+    if queryset is None:
+        queryset = model._default_manager.all()
+    if only:
+        queryset = queryset.only(*only)
+    _reference_querysets[model] = queryset
+
+
+def unregister_reference_queryset(model):
+    _reference_querysets.pop(model, None)
+
+
+def get_reference_queryset(model):
+    try:
+        return _reference_querysets[model].all()
+    except KeyError:
+        return model.objects.all()
 
 
 def acquire_reference(reference):
     try:
         model, identifier = reference.split(':')
-        module, sep, attr = model.rpartition('.')
-        model = getattr(__import__(module, fromlist=(attr,)), attr)
-        return model.objects.get(pk=identifier)
+        model = get_reference_model(model)
+        cache = get_reference_cache()
+        instance = cache.get(model, identifier) if cache is not None else None
+        if instance is None:
+            instance = get_reference_queryset(model).get(pk=identifier)
+            if cache is not None:
+                cache.set(model, identifier, instance)
+        return instance
     except ObjectDoesNotExist:
         return None
     except Exception:
         raise ValueError
 
 
-def identify_instance(instance):
-    model = type(instance)
-    return '%s.%s:%s' % (model.__module__, model.__name__, instance.pk)
+def acquire_references(references):
+    """
+    Resolves an iterable of references performing one query per model,
+    returns a dictionary which maps each reference to its instance (or None)
+    """
+    grouped = {}
+    for reference in set(references):
+        try:
+            model, identifier = reference.split(':')
+        except Exception:
+            raise ValueError
+        grouped.setdefault(model, {})[identifier] = reference
+    cache = get_reference_cache()
+    resolved = {}
+    for model, identifiers in grouped.items():
+        try:
+            model = get_reference_model(model)
+            instances = {}
+            if cache is not None:
+                for identifier in identifiers:
+                    instance = cache.get(model, identifier)
+                    if instance is not None:
+                        instances[identifier] = instance
+            missing = [identifier for identifier in identifiers if identifier not in instances]
+            if missing:
+                for instance in get_reference_queryset(model).filter(pk__in=missing):
+                    identifier = force_text(instance.pk)
+                    instances[identifier] = instance
+                    if cache is not None:
+                        cache.set(model, identifier, instance)
+        except Exception:
+            raise ValueError
+        for identifier, reference in identifiers.items():
+            resolved[reference] = instances.get(identifier)
+    return resolved
+
+
+def is_unresolved_reference(value):
+    """
+    Returns True if value is the string representation of a reference,
+    lazy references are checked first to avoid triggering their retrieval
+    """
+    return not isinstance(value, ReferenceProxy) and isinstance(value, six.string_types)
+
+
+def resolve_references(dictionaries):
+    """
+    Replaces in place the references contained in the supplied dictionaries
+    with model instances, performing one query per referenced model
+    """
+    dictionaries = [d for d in dictionaries if d]
+    references = [value for d in dictionaries for value in d.values()
+                  if is_unresolved_reference(value)]
+    if not references:
+        return
+    resolved = acquire_references(references)
+    for d in dictionaries:
+        for key, value in list(d.items()):
+            if is_unresolved_reference(value):
+                # bypass HStoreDict.__setitem__, the value is already acceptable
+                dict.__setitem__(d, key, resolved[value])
+
+
+class ReferenceProxy(LazyObject):
+    """
+    Lazy reference which knows the model and the primary key of the referenced
+    instance; the instance is retrieved on first access together with all the
+    other pending references of the same model of its batch
+    """
+    def __init__(self, model, identifier, reference, batch):
+        self.__dict__['_reference_model'] = model
+        self.__dict__['_reference_pk'] = model._meta.pk.to_python(identifier)
+        self.__dict__['_reference'] = reference
+        self.__dict__['_batch'] = batch
+        super(ReferenceProxy, self).__init__()
+
+    def _setup(self):
+        self._batch.load(self._reference_model)
+        # might not have been loaded by the batch if added after it was loaded
+        if self._wrapped is empty:
+            self._wrapped = acquire_reference(self._reference)
+
+    def _copy(self, wrapped):
+        proxy = ReferenceProxy.__new__(ReferenceProxy)
+        for name in ('_reference_model', '_reference_pk', '_reference', '_batch'):
+            proxy.__dict__[name] = self.__dict__[name]
+        proxy.__dict__['_wrapped'] = wrapped
+        if wrapped is empty:
+            # resolved together with the other pending references of the batch
+            self._batch.pending.setdefault(self._reference_model, []).append(proxy)
+        return proxy
+
+    def __copy__(self):
+        return self._copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            return self._copy(empty)
+        return self._copy(copy.deepcopy(self._wrapped, memo))
+
+    @property
+    def pk(self):
+        return self._reference_pk
+
+    @property
+    def _meta(self):
+        return self._reference_model._meta
+
+    def __repr__(self):
+        return '<ReferenceProxy: %s>' % self._reference
+
 
+class ReferenceBatch(object):
+    """
+    Collects lazy references, the pending references of a model
+    are resolved all together with a single query
+    """
+    def __init__(self):
+        self.pending = {}
 
-def serialize_references(references):
+    def add(self, reference):
+        try:
+            model, identifier = reference.split(':')
+            model = get_reference_model(model)
+        except Exception:
+            raise ValueError
+        proxy = ReferenceProxy(model, identifier, reference, self)
+        self.pending.setdefault(model, []).append(proxy)
+        return proxy
+
+    def load(self, model):
+        proxies = self.pending.pop(model, [])
+        if not proxies:
+            return
+        resolved = acquire_references([proxy._reference for proxy in proxies])
+        for proxy in proxies:
+            proxy._wrapped = resolved[proxy._reference]
+
+
+def defer_references(dictionaries):
+    """
+    Replaces in place the references contained in the supplied dictionaries
+    with lazy proxies which share the same batch
+    """
+    batch = ReferenceBatch()
+    for d in dictionaries:
+        if not d:
+            continue
+        for key, value in list(d.items()):
+            if is_unresolved_reference(value):
+                dict.__setitem__(d, key, batch.add(value))
+
+
+def get_reference_label(model):
+    """
+    Returns the registered alias of ``model`` or its "app_label.ModelName" label
+    """
+    try:
+        return _reference_aliases[model]
+    except KeyError:
+        return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+
+def register_reference_alias(alias, model):
+    """
+    Registers a short alias used by the compact representation of the references to ``model``
+    """
+    if '.' in alias or ':' in alias:
+        raise ValueError('reference aliases cannot contain dots or colons')
+    _reference_aliases[model] = alias
+    _reference_models[alias] = model
+
+
+def identify_instance(instance, compact=False):
+    # lazy references don't need to be retrieved
+    if isinstance(instance, ReferenceProxy):
+        # and keep their original representation unless the compact one is requested
+        if not compact:
+            return instance._reference
+        model, pk = instance._reference_model, instance._reference_pk
+    else:
+        model, pk = type(instance), instance.pk
+    # deferred instances (django < 1.10) are instances of a dynamically created class
+    if getattr(model, '_deferred', False):
+        model = model._meta.proxy_for_model
+    if compact:
+        return '%s:%s' % (get_reference_label(model), pk)
+    return '%s.%s:%s' % (model.__module__, model.__name__, pk)
+
+
+def convert_reference(reference, compact=True):
+    """
+    Converts the string representation of a reference to the compact
+    (or to the full python path) representation without querying the database
+    """
+    try:
+        model, identifier = reference.split(':')
+        model = get_reference_model(model)
+    except Exception:
+        raise ValueError
+    if compact:
+        return '%s:%s' % (get_reference_label(model), identifier)
+    return '%s.%s:%s' % (model.__module__, model.__name__, identifier)
+
+
+def serialize_references(references, compact=False):
     refs = {}
     # if None or string return empty dict
     if references is None or isinstance(references, six.string_types):
@@ -32,8 +310,8 @@ def serialize_references(references):
     # if dictionary do serialization
     elif isinstance(references, dict):
         for key, instance in references.items():
-            if not isinstance(instance, six.string_types):
-                refs[key] = identify_instance(instance)
+            if not is_unresolved_reference(instance):
+                refs[key] = identify_instance(instance, compact=compact)
             else:
                 refs[key] = instance
         else:
@@ -43,6 +321,35 @@ def serialize_references(references):
         return references
 
 
+def migrate_references(model, field_name, compact=True, batch_size=1000, using=None):
+    """
+    Rewrites the references stored in ``field_name`` by all the rows of ``model``
+    with the compact (or the full python path) representation, in batches of
+    ``batch_size`` rows, each one in its own transaction; returns the number of updated rows
+    """
+    manager = model._base_manager.db_manager(using)
+    using = manager.db
+    updated = 0
+    last_pk = None
+    while True:
+        queryset = manager.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list('pk', field_name)[:batch_size])
+        if not rows:
+            return updated
+        with transaction.atomic(using=using):
+            for pk, references in rows:
+                if not references:
+                    continue
+                converted = dict((key, convert_reference(value, compact) if value else value)
+                                 for key, value in references.items())
+                if converted != dict(references):
+                    manager.filter(pk=pk).update(**{field_name: converted})
+                    updated += 1
+        last_pk = rows[-1][0]
+
+
 def unserialize_references(references):
     refs = {}
     if references is None:
@@ -56,10 +363,58 @@ def unserialize_references(references):
         return refs
 
 
+class StringInterner(object):
+    """
+    Bounded table of strings which allows to share the identical keys and values
+    of many dictionaries instead of keeping a copy of each one in memory
+    """
+    # longer strings are unlikely to be repeated
+    max_length = 100
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.table = {}
+
+    def intern(self, value):
+        if not isinstance(value, six.string_types) or len(value) > self.max_length:
+            return value
+        try:
+            return self.table[value]
+        except KeyError:
+            if len(self.table) < self.maxsize:
+                self.table[value] = value
+            return value
+
+
+_process_interner = None
+
+
+def is_values_query(context=None):
+    """
+    Returns True if the query context belongs to a ``values()`` or ``values_list()`` queryset
+    """
+    return bool(context and context.get('hstore_values'))
+
+
+def get_string_interner(context=None):
+    """
+    Returns the interner of the query context (see ``HStoreQuerySet.intern_strings``)
+    or the process wide interner if enabled with ``DJANGO_HSTORE_INTERN_STRINGS``
+    """
+    global _process_interner
+    interner = context.get('hstore_interner') if context else None
+    if interner is not None:
+        return interner
+    if _process_interner is None:
+        maxsize = getattr(settings, 'DJANGO_HSTORE_INTERN_STRINGS', 0)
+        _process_interner = StringInterner(maxsize) if maxsize else False
+    return _process_interner or None
+
+
 def get_cast_for_param(value_annot, key):
     if not isinstance(value_annot, dict):
         return ''
-    if value_annot[key] in (True, False):
+    if value_annot[key] in (True, False) or value_annot[key] is bool:
         return '::boolean'
     elif issubclass(value_annot[key], datetime):
         return '::timestamp'
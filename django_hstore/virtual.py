@@ -3,7 +3,7 @@ from django.utils import six
 from django.utils.functional import curry
 from django import VERSION as DJANGO_VERSION
 
-from .dict import HStoreDict
+from .dict import FrozenHStoreDict, HStoreDict
 
 
 __all__ = [
@@ -66,6 +66,9 @@ class HStoreVirtualMixin(object):
         field = getattr(instance, self.hstore_field_name)
         if not field:
             return self.default
+        # read only dictionaries hold the raw strings
+        if isinstance(field, FrozenHStoreDict):
+            return self.to_python(field[self.name]) if self.name in field else self.default
         return field.get(self.name, self.default)
 
     def __set__(self, instance, value):
@@ -6,11 +6,17 @@ from django_hstore.apps import GEODJANGO_INSTALLED
 
 __all__ = [
     'Ref',
+    'ProxyRef',
     'DataBag',
+    'ProxyDataBag',
+    'ChildDataBag',
     'SerializedDataBag',
     'SerializedDataBagNoID',
     'NullableDataBag',
+    'ArrayDataBag',
     'RefsBag',
+    'LazyRefsBag',
+    'CompactRefsBag',
     'NullableRefsBag',
     'DefaultsModel',
     'BadDefaultsModel',
@@ -24,6 +30,11 @@ class Ref(models.Model):
     name = models.CharField(max_length=32)
 
 
+class ProxyRef(Ref):
+    class Meta:
+        proxy = True
+
+
 class HStoreModel(models.Model):
     objects = hstore.HStoreManager()
 
@@ -36,6 +47,15 @@ class DataBag(HStoreModel):
     data = hstore.DictionaryField()
 
 
+class ProxyDataBag(DataBag):
+    class Meta:
+        proxy = True
+
+
+class ChildDataBag(DataBag):
+    extra = models.CharField(max_length=32, blank=True)
+
+
 class SerializedDataBag(HStoreModel):
     name = models.CharField(max_length=32)
     data = hstore.SerializedDictionaryField()
@@ -52,11 +72,26 @@ class NullableDataBag(HStoreModel):
     data = hstore.DictionaryField(null=True)
 
 
+class ArrayDataBag(HStoreModel):
+    name = models.CharField(max_length=32)
+    data = hstore.DictionaryField(null=True, read_mode='array')
+
+
 class RefsBag(HStoreModel):
     name = models.CharField(max_length=32)
     refs = hstore.ReferencesField()
 
 
+class LazyRefsBag(HStoreModel):
+    name = models.CharField(max_length=32)
+    refs = hstore.ReferencesField(lazy=True)
+
+
+class CompactRefsBag(HStoreModel):
+    name = models.CharField(max_length=32)
+    refs = hstore.ReferencesField(compact=True)
+
+
 class NullableRefsBag(HStoreModel):
     name = models.CharField(max_length=32)
     refs = hstore.ReferencesField(null=True, blank=True)
@@ -1,33 +1,45 @@
 # -*- coding: utf-8 -*-
+import copy
 import datetime
+import gc
 import json
 import pickle
 import sys
+from collections import OrderedDict
 from decimal import Decimal
 
 from django import VERSION as DJANGO_VERSION
 from django import forms
+from django.apps import apps
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.db import transaction
-from django.db.models.aggregates import Count
+from django.db.models import Case, CharField, IntegerField, Value, When
+from django.db.migrations.state import ProjectState
+from django.db.models.aggregates import Count, Sum
+from django.db.models.signals import post_save
 from django.db.utils import IntegrityError
 from django.test import TestCase
 from django.utils.encoding import force_text
 
-from django_hstore import get_version
+from django_hstore import aggregates, get_version, hstore
+from django_hstore.dict import FrozenHStoreDict, PartialHStoreDict
 from django_hstore.exceptions import HStoreDictException
+from django_hstore.expressions import HStoreAKeys, HStoreHasKey, HStoreKey, HStoreLen, HStoreSlice
 from django_hstore.fields import HStoreDict
 from django_hstore.forms import DictionaryFieldWidget
 from django_hstore.utils import get_cast_for_param
 
 from django_hstore_tests.models import (
+    ArrayDataBag,
     BadDefaultsModel,
+    ChildDataBag,
     DataBag,
     DefaultsModel,
     NullableDataBag,
     NumberedDataBag,
+    ProxyDataBag,
     UniqueTogetherDataBag
 )
 
@@ -52,6 +64,146 @@ class TestDictionaryField(TestCase):
         self.assertEqual(alpha.data, {'v': '1', 'v2': '3'})
         self.assertEqual(beta.data, {'v': '2', 'v2': '4'})
 
+    def test_hstore_dict_from_db(self):
+        self._create_bags()
+        alpha = DataBag.objects.get(name='alpha')
+        self.assertTrue(isinstance(alpha.data, HStoreDict))
+        self.assertIs(alpha.data.instance, alpha)
+        self.assertIs(alpha.data.field, DataBag._meta.get_field('data'))
+        self.assertEqual(alpha.data, {'v': '1', 'v2': '3'})
+        # values() and values_list() return the dictionaries as retrieved
+        data = DataBag.objects.filter(name='alpha').values_list('data', flat=True)[0]
+        self.assertEqual(data, {'v': '1', 'v2': '3'})
+        self.assertIs(type(data), dict)
+        self.assertIs(type(DataBag.objects.filter(name='alpha').values('data')[0]['data']), dict)
+        # assigning a loaded dictionary to another instance makes a copy
+        other = DataBag(name='other', data=alpha.data)
+        self.assertIsNot(other.data, alpha.data)
+        self.assertIs(other.data.instance, other)
+
+    def test_save_changes_only(self):
+        self._create_bags()
+        alpha = DataBag.objects.get(name='alpha')
+        # another process updates the same row in the meantime
+        DataBag.objects.filter(name='alpha').hupdate('data', {'other': 'x'})
+        alpha.data['v'] = '5'
+        del alpha.data['v2']
+        alpha.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'v': '5', 'other': 'x'})
+        # changes are tracked again after saving
+        alpha.data.pop('v')
+        alpha.save(update_fields=['data'])
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'other': 'x'})
+        # assigning a new dictionary overwrites the whole value
+        alpha.data = {'new': '1'}
+        alpha.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'new': '1'})
+
+    def test_save_assigned_dictionary(self):
+        alpha, beta = self._create_bags()
+        beta = DataBag.objects.get(name='beta')
+        beta.data = DataBag.objects.values_list('data', flat=True).get(pk=alpha.pk)
+        beta.save()
+        self.assertEqual(DataBag.objects.get(name='beta').data, {'v': '1', 'v2': '3'})
+        # a dictionary built from another row is not adopted by a loaded instance
+        field = DataBag._meta.get_field('data')
+        beta.data = HStoreDict.from_db({'v': '7'}, field)
+        self.assertIsNone(beta.data.get_changes())
+        beta.save()
+        self.assertEqual(DataBag.objects.get(name='beta').data, {'v': '7'})
+        # nor saved as an empty change set by a new instance of an existing row
+        sliced = DataBag.objects.annotate(sliced=HStoreSlice('data', ['v'])).get(pk=alpha.pk).sliced
+        DataBag(pk=beta.pk, name='beta', data=sliced).save()
+        self.assertEqual(DataBag.objects.get(name='beta').data, {'v': '1'})
+
+    def test_track_changes_receiver(self):
+        receivers = len(post_save.receivers)
+        # the models built by migrations don't register receivers
+        ProjectState.from_apps(apps).apps
+        self.assertEqual(len(post_save.receivers), receivers)
+
+    def test_save_changes_only_subclasses(self):
+        for model in (ProxyDataBag, ChildDataBag):
+            bag = model.objects.create(name='bag', data={'a': '1', 'b': '2'})
+            bag = model.objects.get(pk=bag.pk)
+            bag.data['a'] = '3'
+            bag.save()
+            # changes are tracked again after saving, hence the key isn't sent again
+            DataBag.objects.filter(pk=bag.pk).hupdate('data', {'a': '4'})
+            bag.data['b'] = '5'
+            bag.save()
+            self.assertEqual(DataBag.objects.get(pk=bag.pk).data, {'a': '4', 'b': '5'})
+
+    def test_track_changes(self):
+        data = HStoreDict({'a': '1', 'b': '2', 'c': '3'})
+        self.assertIsNone(data.get_changes())
+        data.track_changes()
+        data['a'] = 4
+        del data['b']
+        data.setdefault('d', '5')
+        data.pop('c')
+        data['c'] = '6'
+        changed, removed = data.get_changes()
+        self.assertEqual(changed, {'a': '4', 'c': '6', 'd': '5'})
+        self.assertEqual(removed, ['b'])
+
+    def test_weak_instance_reference(self):
+        DataBag.objects.create(name='bag', data={'a': '1'})
+        bag = DataBag.objects.get(name='bag')
+        data = bag.data
+        self.assertFalse(hasattr(data, '__dict__'))
+        self.assertIs(data.instance, bag)
+        data['b'] = '2'
+        unpickled = pickle.loads(pickle.dumps(bag))
+        self.assertIs(unpickled.data.instance, unpickled)
+        self.assertEqual(unpickled.data.get_changes(), ({'b': '2'}, []))
+        del bag
+        self.assertIsNone(data.instance)
+
+    def test_hstore_readonly(self):
+        self._create_bags()
+        alpha = DataBag.objects.hstore_readonly().get(name='alpha')
+        self.assertIsInstance(alpha.data, FrozenHStoreDict)
+        self.assertEqual(alpha.data, {'v': '1', 'v2': '3'})
+        self.assertEqual(hash(alpha.data), hash(FrozenHStoreDict({'v2': '3', 'v': '1'})))
+        self.assertRaises(TypeError, alpha.data.__setitem__, 'v', '2')
+        self.assertRaises(TypeError, alpha.data.__delitem__, 'v')
+        self.assertRaises(TypeError, alpha.data.update, {'v': '2'})
+        self.assertRaises(TypeError, alpha.data.pop, 'v')
+        self.assertEqual(pickle.loads(pickle.dumps(alpha.data)), alpha.data)
+        # the whole dictionary can be replaced and saved
+        alpha.data = dict(alpha.data, v='5')
+        alpha.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'v': '5', 'v2': '3'})
+
+    def test_array_read_mode(self):
+        ArrayDataBag.objects.create(name='alpha', data={'v': '1', 'n': None})
+        ArrayDataBag.objects.create(name='null', data=None)
+        self.assertIn('hstore_to_array(', str(ArrayDataBag.objects.all().query))
+        alpha = ArrayDataBag.objects.get(name='alpha')
+        self.assertIsInstance(alpha.data, HStoreDict)
+        self.assertEqual(alpha.data, {'v': '1', 'n': None})
+        self.assertIsNone(ArrayDataBag.objects.get(name='null').data)
+        self.assertEqual(ArrayDataBag.objects.filter(name='alpha').values_list('data', flat=True)[0],
+                         {'v': '1', 'n': None})
+        alpha.data['v'] = '2'
+        alpha.save()
+        self.assertEqual(ArrayDataBag.objects.filter(data__contains={'v': '2'}).count(), 1)
+        self.assertRaises(ValueError, hstore.DictionaryField, read_mode='text')
+        field = ArrayDataBag._meta.get_field('data')
+        self.assertEqual(field.deconstruct()[3]['read_mode'], 'array')
+        self.assertEqual(field.clone().read_mode, 'array')
+        self.assertNotIn('read_mode', DataBag._meta.get_field('data').deconstruct()[3])
+
+    def test_intern_strings(self):
+        self._create_bags()
+        alpha, beta = DataBag.objects.intern_strings().order_by('name')
+        self.assertEqual(alpha.data, {'v': '1', 'v2': '3'})
+        self.assertEqual(beta.data, {'v': '2', 'v2': '4'})
+        alpha_keys, beta_keys = sorted(alpha.data.keys()), sorted(beta.data.keys())
+        self.assertIs(alpha_keys[0], beta_keys[0])
+        self.assertIs(alpha_keys[1], beta_keys[1])
+
     def test_decimal(self):
         databag = DataBag(name='decimal')
         databag.data['dec'] = Decimal('1.01')
@@ -385,6 +537,28 @@ class TestDictionaryField(TestCase):
         self.assertEqual(DataBag.objects.hkeys(id=alpha.id, attr='data'), ['v', 'v2'])
         self.assertEqual(DataBag.objects.hkeys(id=beta.id, attr='data'), ['v', 'v2'])
 
+    def test_hkeys_distinct(self):
+        alpha, beta = self._create_bags()
+        DataBag.objects.create(name='gamma', data={'v': '3', 'v3': '5'})
+        self.assertEqual(DataBag.objects.hkeys('data', distinct=True), ['v', 'v2', 'v3'])
+        self.assertEqual(DataBag.objects.exclude(name='gamma').hkeys('data', distinct=True), ['v', 'v2'])
+        self.assertEqual(DataBag.objects.hkeys('data', counts=True), OrderedDict([('v', 3), ('v2', 2), ('v3', 1)]))
+        self.assertEqual(list(DataBag.objects.hkeys('data', counts=True, iterator=True)),
+                         [('v', 3), ('v2', 2), ('v3', 1)])
+        self.assertEqual(DataBag.objects.hkeys('data', distinct=True, sample=100), ['v', 'v2', 'v3'])
+        self.assertEqual(DataBag.objects.none().hkeys('data', distinct=True), [])
+        self.assertEqual(DataBag.objects.filter(name='alpha').hkeys('data', sample=100), ['v', 'v2'])
+        # slices limit the rows, not the keys
+        self.assertEqual(DataBag.objects.order_by('name')[:1].hkeys('data', distinct=True), ['v', 'v2'])
+        self.assertEqual(DataBag.objects.order_by('-name')[:1].hkeys('data', distinct=True), ['v', 'v3'])
+        # iterator alone enumerates the keys of the first row
+        self.assertEqual(sorted(DataBag.objects.filter(name='gamma').hkeys('data', iterator=True)), ['v', 'v3'])
+        self.assertRaises(ValueError, DataBag.objects.hkeys, 'data', sample=0)
+        self.assertRaises(ValueError, DataBag.objects.hkeys, 'data', distinct=True, sample=101)
+        ChildDataBag.objects.create(name='delta', data={'w': '1'})
+        self.assertEqual(ChildDataBag.objects.hkeys('data', distinct=True, sample=100), ['w'])
+        self.assertRaises(ValueError, DataBag.objects.hkeys, 'name', distinct=True)
+
     def test_hpeek(self):
         alpha, beta = self._create_bags()
         self.assertEqual(DataBag.objects.hpeek(id=alpha.id, attr='data', key='v'), '1')
@@ -401,6 +575,150 @@ class TestDictionaryField(TestCase):
         DataBag.objects.filter(name='beta').hremove('data', ['v', 'v2'])
         self.assertEqual(DataBag.objects.get(name='beta').data, {})
 
+    def test_hrows(self):
+        DataBag.objects.create(name='alpha', data={'v': '1', 'v2': '3.5', 'flag': 'true'})
+        DataBag.objects.create(name='beta', data={'v': '2'})
+        rows = list(DataBag.objects.order_by('name').hrows('name', keys={'data': ['v', 'v2']}))
+        self.assertEqual(rows, [('alpha', '1', '3.5'), ('beta', '2', None)])
+        self.assertEqual(rows[0].name, 'alpha')
+        self.assertEqual(rows[0].v2, '3.5')
+        keys = {'data': OrderedDict([('v', int), ('v2', float), ('flag', bool)])}
+        row = next(DataBag.objects.filter(name='alpha').hrows('id', keys=keys))
+        self.assertEqual((row.v, row.v2, row.flag), (1, 3.5, True))
+        self.assertRaises(ValueError, DataBag.objects.hrows, 'name', keys={'name': ['v']})
+        # the column is selected from the table of the parent model
+        ChildDataBag.objects.create(name='child', data={'v': '3', 'name': 'x'})
+        rows = list(ChildDataBag.objects.hrows('name', 'extra', keys={'data': {'v': int}}))
+        self.assertEqual(rows, [('child', '', 3)])
+        # keys can be named as the model fields
+        self.assertEqual(list(ChildDataBag.objects.hrows(keys={'data': ['name']})), [('x',)])
+
+    def test_hvalues_list(self):
+        alpha, beta = self._create_bags()
+        DataBag.objects.create(name='gamma', data={'v2': '5'})
+        queryset = DataBag.objects.order_by('name')
+        self.assertEqual(list(queryset.hvalues_list('data', ['v', 'v2'])), [('1', '3'), ('2', '4'), (None, '5')])
+        self.assertEqual(list(queryset.hvalues_list('data', 'v', flat=True)), ['1', '2', None])
+        self.assertEqual(list(queryset.hvalues_list('data', ['v2'], flat=True, cast=int)), [3, 4, 5])
+        self.assertEqual(list(queryset.filter(name='alpha').hvalues_list('data', ['v', 'v2'], cast={'v': int})),
+                         [(1, '3')])
+        self.assertEqual(list(DataBag.objects.hvalues_list('data', 'v2', flat=True, cast=int)), [3, 4, 5])
+        self.assertRaises(TypeError, queryset.hvalues_list, 'data', ['v', 'v2'], flat=True)
+        self.assertRaises(ValueError, queryset.hvalues_list, 'name', ['v'])
+        ChildDataBag.objects.create(name='child', data={'v': '6'})
+        self.assertEqual(list(ChildDataBag.objects.hvalues_list('data', 'v', flat=True, cast=int)), [6])
+
+    def test_expressions(self):
+        DataBag.objects.create(name='alpha', data={'v': '10', 'v2': '3'})
+        DataBag.objects.create(name='beta', data={'v': '9'})
+        DataBag.objects.create(name='gamma', data={})
+        v = HStoreKey('data', 'v', output_field=IntegerField())
+        queryset = DataBag.objects.exclude(name='gamma')
+        self.assertEqual([bag.name for bag in queryset.order_by(v)], ['beta', 'alpha'])
+        self.assertEqual(list(queryset.annotate(v=v).order_by('-v').values_list('v', flat=True)), [10, 9])
+        self.assertEqual(queryset.aggregate(total=Sum(v))['total'], 19)
+        self.assertEqual(list(queryset.annotate(v=HStoreKey('data', 'v')).order_by('v').values_list('v', flat=True)),
+                         ['10', '9'])
+        queryset = DataBag.objects.order_by('name').annotate(
+            has_v2=HStoreHasKey('data', 'v2'),
+            sliced=HStoreSlice('data', ['v2', 'v3']),
+            keys=HStoreAKeys('data'),
+            length=HStoreLen('data'),
+            label=Case(When(data__contains=['v2'], then=HStoreKey('data', 'v2')), default=Value('-'),
+                       output_field=CharField())
+        )
+        self.assertEqual([(bag.has_v2, bag.sliced, sorted(bag.keys), bag.length, bag.label) for bag in queryset], [
+            (True, {'v2': '3'}, ['v', 'v2'], 2, '3'),
+            (False, {}, ['v'], 1, '-'),
+            (False, {}, [], 0, '-')
+        ])
+        counts = DataBag.objects.annotate(length=HStoreLen('data')).values('length').annotate(count=Count('id'))
+        self.assertEqual(sorted((row['length'], row['count']) for row in counts), [(0, 1), (1, 1), (2, 1)])
+
+    def test_only_keys(self):
+        DataBag.objects.create(name='alpha', data={'a': '1', 'b': '2', 'c': '3', 'd': '4'})
+        bag = DataBag.objects.only_keys('data', ['a', 'x']).get(name='alpha')
+        self.assertIsInstance(bag.data, PartialHStoreDict)
+        self.assertTrue(bag.data.partial)
+        self.assertEqual(dict(bag.data), {'a': '1'})
+        # missing keys are retrieved when accessed
+        self.assertEqual(bag.data['b'], '2')
+        self.assertTrue('c' in bag.data)
+        self.assertEqual(bag.data.get('x'), None)
+        self.assertEqual(dict(bag.data), {'a': '1', 'b': '2', 'c': '3'})
+        # saving updates only the changed and removed keys
+        bag.data['a'] = '10'
+        del bag.data['b']
+        bag.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'a': '10', 'c': '3', 'd': '4'})
+        bag.data.load()
+        self.assertFalse(bag.data.partial)
+        self.assertEqual(bag.data, {'a': '10', 'c': '3', 'd': '4'})
+        # the projection is performed by the database
+        values = DataBag.objects.filter(name='alpha').only_keys('data', ['c', 'd']).values_list('data', flat=True)
+        self.assertEqual(list(values), [{'c': '3', 'd': '4'}])
+        # only the column is restricted to the specified keys, not the expressions based on it
+        bag = DataBag.objects.only_keys('data', ['c']).annotate(sliced=HStoreSlice('data', ['d'])).get(name='alpha')
+        self.assertEqual(bag.sliced, {'d': '4'})
+        self.assertNotIsInstance(bag.sliced, PartialHStoreDict)
+        self.assertEqual(dict(bag.data), {'c': '3'})
+        self.assertRaises(ValueError, DataBag.objects.only_keys, 'name', ['a'])
+
+    def test_only_keys_reassign(self):
+        DataBag.objects.create(name='alpha', data={'a': '1', 'b': '2', 'c': '3'})
+        bag = DataBag.objects.only_keys('data', ['a', 'b']).get(name='alpha')
+        bag.data = bag.data
+        bag.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'a': '1', 'b': '2', 'c': '3'})
+        # copies stay partial and keep the pending changes
+        del bag.data['b']
+        bag.data = copy.copy(bag.data)
+        self.assertTrue(bag.data.partial)
+        bag.data['a'] = '10'
+        bag.save()
+        self.assertEqual(DataBag.objects.get(name='alpha').data, {'a': '10', 'c': '3'})
+
+    def test_only_keys_without_instance(self):
+        DataBag.objects.create(name='alpha', data={'a': '1', 'b': '2'})
+        data = DataBag.objects.only_keys('data', ['a']).get(name='alpha').data
+        gc.collect()
+        self.assertIsNone(data.instance)
+        # the missing keys are retrieved from the row the dictionary comes from
+        self.assertEqual(data['b'], '2')
+        unbound = PartialHStoreDict.from_db({'a': '1'}, DataBag._meta.get_field('data'), keys=['a'])
+        self.assertRaises(HStoreDictException, unbound.__getitem__, 'b')
+
+    def test_haggregate(self):
+        DataBag.objects.create(name='alpha', data={'kind': 'a', 'price': '10.5', 'qty': '1'})
+        DataBag.objects.create(name='beta', data={'kind': 'a', 'price': '2', 'qty': '3'})
+        DataBag.objects.create(name='gamma', data={'kind': 'b', 'price': '4'})
+        specs = {
+            'total': aggregates.Sum('price', cast=Decimal),
+            'average': aggregates.Avg('price'),
+            'lowest': aggregates.Min('price', cast=float),
+            'qty': aggregates.Max('qty', cast=int),
+            'with_qty': aggregates.Count('qty'),
+            'median': aggregates.Percentile('price', 0.5)
+        }
+        result = DataBag.objects.haggregate('data', specs)
+        self.assertEqual(result, {
+            'total': Decimal('16.5'), 'average': 5.5, 'lowest': 2.0, 'qty': 3, 'with_qty': 2, 'median': 4.0
+        })
+        result = DataBag.objects.order_by('name').haggregate('data', specs, group_by='kind')
+        self.assertEqual(list(result), ['a', 'b'])
+        self.assertEqual(result['a']['total'], Decimal('12.5'))
+        self.assertEqual(result['a']['median'], 6.25)
+        self.assertEqual(result['b'], {
+            'total': Decimal('4'), 'average': 4.0, 'lowest': 4.0, 'qty': None, 'with_qty': 0, 'median': 4.0
+        })
+        # values are compared as numbers unless a cast is specified
+        result = DataBag.objects.haggregate('data', {
+            'highest': aggregates.Max('price'), 'lowest': aggregates.Min('price'),
+            'last': aggregates.Max('price', cast=str)
+        })
+        self.assertEqual(result, {'highest': Decimal('10.5'), 'lowest': Decimal('2'), 'last': '4'})
+        self.assertRaises(ValueError, DataBag.objects.haggregate, 'name', specs)
+
     def test_hslice(self):
         alpha, beta = self._create_bags()
         self.assertEqual(DataBag.objects.hslice(id=alpha.id, attr='data', keys=['v']), {'v': '1'})
@@ -412,6 +730,9 @@ class TestDictionaryField(TestCase):
         self.assertEqual(DataBag.objects.get(name='alpha').data, alpha.data)
         DataBag.objects.filter(name='alpha').hupdate('data', {'v2': '10', 'v3': '20'})
         self.assertEqual(DataBag.objects.get(name='alpha').data, {'v': '1', 'v2': '10', 'v3': '20'})
+        # values are normalized as when saving
+        DataBag.objects.filter(name='beta').hupdate('data', {'v': 5, 'flag': True, 'list': [1]})
+        self.assertEqual(DataBag.objects.get(name='beta').data, {'v': '5', 'v2': '4', 'flag': 'true', 'list': '[1]'})
 
     def test_hupdate_atomic(self):
         """ https://github.com/djangonauts/django-hstore/issues/84 """
@@ -693,6 +1014,7 @@ class TestDictionaryField(TestCase):
     def test_get_cast_for_param(self):
         self.assertEqual(get_cast_for_param([], 'a'), '')
         self.assertEqual(get_cast_for_param({'a': True}, 'a'), '::boolean')
+        self.assertEqual(get_cast_for_param({'a': bool}, 'a'), '::boolean')
         self.assertEqual(get_cast_for_param({'a': datetime.datetime}, 'a'), '::timestamp')
         self.assertEqual(get_cast_for_param({'a': datetime.time}, 'a'), '::time')
         self.assertEqual(get_cast_for_param({'a': int}, 'a'), '::bigint')
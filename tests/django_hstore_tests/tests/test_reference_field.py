@@ -1,12 +1,18 @@
+import copy
+
 from django import forms
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
 
 from django_hstore.forms import ReferencesFieldWidget
-from django_hstore.utils import acquire_reference, serialize_references, unserialize_references
+from django_hstore.utils import (ReferenceProxy, acquire_reference, acquire_references,
+                                 get_reference_model, is_unresolved_reference, migrate_references,
+                                 register_reference_queryset, serialize_references,
+                                 unregister_reference_queryset, unserialize_references)
 
-from django_hstore_tests.models import NullableRefsBag, Ref, RefsBag
+from django_hstore_tests.models import CompactRefsBag, LazyRefsBag, NullableRefsBag, ProxyRef, Ref, RefsBag
 
 
 class TestReferencesField(TestCase):
@@ -49,6 +55,145 @@ class TestReferencesField(TestCase):
         self.assertEqual(alpha.refs.get('idontexist', 'default'), 'default')
         self.assertEqual(alpha.refs.get('idontexist'), None)
 
+    def test_batched_retrieval(self):
+        alpha, beta, refs = self._create_bags()
+        alpha = RefsBag.objects.get(name='alpha')
+        # all the references are resolved with a single query
+        with self.assertNumQueries(1):
+            self.assertEqual(alpha.refs['0'], refs[0])
+            self.assertEqual(alpha.refs['1'], refs[1])
+
+    def test_resolve_all(self):
+        alpha, beta, refs = self._create_bags()
+        alpha = RefsBag.objects.get(name='alpha')
+        with self.assertNumQueries(1):
+            alpha.refs.resolve_all()
+        with self.assertNumQueries(0):
+            self.assertEqual(dict(alpha.refs), {'0': refs[0], '1': refs[1]})
+
+    def test_prefetch_references(self):
+        alpha, beta, refs = self._create_bags()
+        # one query for the bags and one for the referenced objects
+        with self.assertNumQueries(2):
+            bags = list(RefsBag.objects.prefetch_references('refs').order_by('name'))
+        with self.assertNumQueries(0):
+            self.assertEqual([bag.refs['0'] for bag in bags], [refs[0], refs[2]])
+            self.assertEqual([bag.refs['1'] for bag in bags], [refs[1], refs[3]])
+
+    def test_prefetch_references_iterator(self):
+        alpha, beta, refs = self._create_bags()
+        with self.assertNumQueries(2):
+            bags = RefsBag.objects.prefetch_references('refs').order_by('name').iterator()
+            self.assertEqual([bag.refs['1'] for bag in bags], [refs[1], refs[3]])
+
+    def test_prefetch_references_invalid_field(self):
+        with self.assertRaises(ValueError):
+            RefsBag.objects.prefetch_references('name')
+
+    def test_lazy_references(self):
+        refs = [Ref.objects.create(name=str(i)) for i in range(2)]
+        LazyRefsBag.objects.create(name='lazy', refs={'0': refs[0], '1': refs[1]})
+        bag = LazyRefsBag.objects.get(name='lazy')
+        with self.assertNumQueries(0):
+            self.assertTrue(isinstance(bag.refs['0'], ReferenceProxy))
+            self.assertEqual([bag.refs['0'].pk, bag.refs['1'].pk], [refs[0].pk, refs[1].pk])
+            self.assertEqual(bag.refs['0']._meta.model, Ref)
+        # saving doesn't need to retrieve the references either
+        with self.assertNumQueries(1):
+            bag.save()
+        # the first attribute access retrieves all the pending references
+        with self.assertNumQueries(1):
+            self.assertEqual(bag.refs['0'].name, '0')
+            self.assertEqual(bag.refs['1'].name, '1')
+
+    def test_lazy_deleted_reference(self):
+        refs = [Ref.objects.create(name=str(i)) for i in range(2)]
+        LazyRefsBag.objects.create(name='lazy', refs={'0': refs[0], '1': refs[1]})
+        refs[1].delete()
+        bag = LazyRefsBag.objects.get(name='lazy')
+        self.assertFalse(bag.refs['1'])
+        # once resolved, proxies are read as the referenced instances (None if deleted)
+        self.assertEqual(bag.refs['0'].name, '0')
+        self.assertEqual(type(bag.refs['0']), Ref)
+        self.assertIsNone(bag.refs['1'])
+        self.assertIsNone(bag.refs.get('1'))
+
+    def test_lazy_references_copy(self):
+        refs = [Ref.objects.create(name=str(i)) for i in range(2)]
+        LazyRefsBag.objects.create(name='lazy', refs={'0': refs[0], '1': refs[1]})
+        bag = LazyRefsBag.objects.get(name='lazy')
+        proxy = bag.refs['0']
+        with self.assertNumQueries(0):
+            copied = copy.copy(bag.refs)
+            deep = copy.deepcopy(bag.refs)
+            self.assertIsInstance(copy.deepcopy(proxy), ReferenceProxy)
+        # copies are resolved with the other references of the batch
+        with self.assertNumQueries(1):
+            self.assertEqual(deep['0'].name, '0')
+            self.assertEqual(copied['1'].name, '1')
+            self.assertEqual(proxy.name, '0')
+
+    def test_deconstruct_lazy(self):
+        field = LazyRefsBag._meta.get_field('refs')
+        self.assertEqual(field.deconstruct()[3], {'lazy': True})
+        self.assertTrue(field.clone().lazy)
+        self.assertEqual(RefsBag._meta.get_field('refs').deconstruct()[3], {})
+
+    def test_lazy_prefetch_references(self):
+        refs = [Ref.objects.create(name=str(i)) for i in range(4)]
+        LazyRefsBag.objects.create(name='alpha', refs={'0': refs[0], '1': refs[1]})
+        LazyRefsBag.objects.create(name='beta', refs={'0': refs[2], '1': refs[3]})
+        with self.assertNumQueries(1):
+            bags = list(LazyRefsBag.objects.prefetch_references('refs').order_by('name'))
+        with self.assertNumQueries(1):
+            self.assertEqual([bag.refs['1'].name for bag in bags], ['1', '3'])
+
+    def test_values_references(self):
+        alpha, beta, refs = self._create_bags()
+        # values() and values_list() return the references as strings, without queries
+        with self.assertNumQueries(1):
+            raw = RefsBag.objects.values_list('refs', flat=True).get(pk=alpha.pk)
+            self.assertTrue(is_unresolved_reference(raw['0']))
+        self.assertEqual(acquire_reference(raw['0']), refs[0])
+        with self.assertNumQueries(1):
+            raw = RefsBag.objects.filter(pk=alpha.pk).values('refs')[0]['refs']
+            self.assertIs(type(raw), dict)
+
+    def test_compact_references(self):
+        ref = Ref.objects.create(name='compact')
+        bag = CompactRefsBag.objects.create(name='bag', refs={'0': ref})
+        raw = CompactRefsBag.objects.values_list('refs', flat=True).get(pk=bag.pk)
+        self.assertEqual(dict(raw), {'0': 'django_hstore_tests.Ref:%s' % ref.pk})
+        self.assertEqual(CompactRefsBag.objects.get(pk=bag.pk).refs['0'], ref)
+        self.assertEqual(CompactRefsBag.objects.filter(refs__contains={'0': ref}).count(), 1)
+        field = CompactRefsBag._meta.get_field('refs')
+        self.assertEqual(field.deconstruct()[3], {'compact': True})
+        self.assertTrue(field.clone().compact)
+
+    def test_migrate_references(self):
+        alpha, beta, refs = self._create_bags()
+        self.assertEqual(migrate_references(RefsBag, 'refs', batch_size=1), 2)
+        raw = RefsBag.objects.values_list('refs', flat=True).get(pk=alpha.pk)
+        self.assertEqual(dict(raw), {'0': 'django_hstore_tests.Ref:%s' % refs[0].pk,
+                                     '1': 'django_hstore_tests.Ref:%s' % refs[1].pk})
+        # old and compact representations are both readable
+        self.assertEqual(RefsBag.objects.get(pk=alpha.pk).refs['0'], refs[0])
+        # already migrated rows are not updated again
+        self.assertEqual(migrate_references(RefsBag, 'refs'), 0)
+        self.assertEqual(migrate_references(RefsBag, 'refs', compact=False), 2)
+        self.assertEqual(RefsBag.objects.filter(refs__contains={'0': refs[0]}).count(), 1)
+
+    def test_acquire_references(self):
+        alpha, beta, refs = self._create_bags()
+        references = ['django_hstore_tests.models.Ref:%s' % ref.pk for ref in refs]
+        references.append('django_hstore_tests.models.Ref:0')
+        with self.assertNumQueries(1):
+            resolved = acquire_references(references)
+        self.assertEqual([resolved[reference] for reference in references[:4]], refs)
+        self.assertIsNone(resolved['django_hstore_tests.models.Ref:0'])
+        with self.assertRaises(ValueError):
+            acquire_references(['invalid'])
+
     def test_empty_querying(self):
         RefsBag.objects.create(name='bag')
         self.assertTrue(RefsBag.objects.get(refs={}))
@@ -112,6 +257,11 @@ class TestReferencesField(TestCase):
         RefsBag.objects.filter(name='beta').hremove('refs', ['0', '1'])
         self.assertEqual(RefsBag.objects.get(name='beta').refs, {})
 
+    def test_hupdate(self):
+        alpha, beta, refs = self._create_bags()
+        RefsBag.objects.filter(name='alpha').hupdate('refs', {'2': refs[1]})
+        self.assertEqual(RefsBag.objects.get(name='alpha').refs['2'], refs[1])
+
     def test_hslice(self):
         alpha, beta, refs = self._create_bags()
         self.assertEqual(RefsBag.objects.hslice(id=alpha.id, attr='refs', keys=['0']), {'0': refs[0]})
@@ -156,6 +306,43 @@ class TestReferencesField(TestCase):
         self.assertEqual(serialize_references(None), {})
         self.assertEqual(serialize_references({'test': 'test'}), {'test': 'test'})
 
+    def test_get_reference_model(self):
+        self.assertIs(get_reference_model('django_hstore_tests.models.Ref'), Ref)
+        self.assertIs(get_reference_model('django_hstore_tests.Ref'), Ref)
+
+    def test_register_reference_queryset(self):
+        alpha, beta, refs = self._create_bags()
+        register_reference_queryset(Ref, only=['id'])
+        try:
+            ref = acquire_reference('django_hstore_tests.models.Ref:%s' % refs[0].pk)
+            self.assertEqual(ref, refs[0])
+            self.assertIn('name', ref.get_deferred_fields())
+        finally:
+            unregister_reference_queryset(Ref)
+        ref = acquire_reference('django_hstore_tests.models.Ref:%s' % refs[0].pk)
+        self.assertNotIn('name', ref.get_deferred_fields())
+
+    @override_settings(DJANGO_HSTORE_REFERENCE_CACHE={'SCOPE': 'thread', 'MAXSIZE': 10})
+    def test_reference_cache(self):
+        alpha, beta, refs = self._create_bags()
+        with self.assertNumQueries(2):
+            self.assertEqual(RefsBag.objects.get(name='alpha').refs['0'], refs[0])
+        # referenced instances are now cached
+        with self.assertNumQueries(1):
+            self.assertEqual(RefsBag.objects.get(name='alpha').refs['0'], refs[0])
+        # saving the referenced instance invalidates the cache
+        refs[0].name = 'changed'
+        refs[0].save()
+        with self.assertNumQueries(2):
+            self.assertEqual(RefsBag.objects.get(name='alpha').refs['0'].name, 'changed')
+        # as well as saving it through a proxy model
+        ProxyRef.objects.filter(pk=refs[0].pk).get().save()
+        with self.assertNumQueries(2):
+            RefsBag.objects.get(name='alpha').refs['0']
+        ProxyRef.objects.get(pk=refs[0].pk).delete()
+        with self.assertNumQueries(2):
+            self.assertIsNone(RefsBag.objects.get(name='alpha').refs['0'])
+
     def test_acquire_references_value_error(self):
         with self.assertRaises(ValueError):
             acquire_reference(None)
@@ -2,6 +2,7 @@
 import os
 import shutil
 import sys
+from decimal import Decimal
 
 import django
 from django.contrib.auth.models import User
@@ -46,6 +47,34 @@ class TestSchemaMode(TestCase):
         # login as admin
         self.client.login(username='admin', password='tester')
 
+    def test_typed_values_cache(self):
+        d = SchemaDataBag().data
+        d['number'] = 2
+        self.assertEqual(d['number'], 2)
+        self.assertEqual(d._typed_values, {'number': 2})
+        # converted value is cached, decimals are parsed to a new object on each conversion
+        d['decimal'] = Decimal('1.5')
+        self.assertIsNot(SchemaDataBag._hstore_virtual_fields['decimal'].to_python('1.5'),
+                         SchemaDataBag._hstore_virtual_fields['decimal'].to_python('1.5'))
+        self.assertIs(d['decimal'], d['decimal'])
+        self.assertEqual(d['decimal'], Decimal('1.5'))
+        d['number'] = 3
+        self.assertEqual(d['number'], 3)
+        d.update({'number': 4})
+        self.assertEqual(d['number'], 4)
+        del d['number']
+        self.assertNotIn('number', d._typed_values)
+        self.assertRaises(KeyError, d.__getitem__, 'number')
+
+    def test_hstore_readonly(self):
+        SchemaDataBag.objects.create(name='readonly', number=3, boolean=True)
+        d = SchemaDataBag.objects.hstore_readonly().get(name='readonly')
+        self.assertEqual(d.number, 3)
+        self.assertEqual(d.boolean, True)
+        self.assertEqual(d.data['number'], '3')
+        with self.assertRaises(TypeError):
+            d.number = 4
+
     def test_to_python_conversion(self):
         d = SchemaDataBag().data
         d['number'] = 2
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 import datetime
+import json
+from collections import OrderedDict
 
 from django import forms
 from django.contrib.auth.models import User
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db.models.aggregates import Count
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import six
 
+from django_hstore import hstore
+from django_hstore.dict import LazySerializedDict
 from django_hstore.forms import SerializedDictionaryFieldWidget
+from django_hstore.serializers import CallableSerializer, DeserializationMemo, JSONSerializer, get_serializer
 
 from django_hstore_tests.models import SerializedDataBag, SerializedDataBagNoID
 
@@ -204,6 +211,39 @@ class TestSerializedDictionaryField(TestCase):
         self.assertEqual(len(r), 1)
         self.assertEqual(r[0], alpha)
 
+    def test_key_value_jsonb_querying(self):
+        alpha, beta = self._create_bags()
+        r = SerializedDataBag.objects.filter(data__contains={'v2': [1, '4', 5, {'f': 6}]})
+        self.assertEqual(list(r), [beta])
+        r = SerializedDataBag.objects.filter(data__contains={'v2': '3'})
+        self.assertEqual(list(r), [alpha])
+        r = SerializedDataBag.objects.filter(data__gt={'v3': {'a': 1}})
+        self.assertEqual(list(r), [beta])
+        r = SerializedDataBag.objects.filter(data__lte={'v3': {'a': 1}, 'v': 1})
+        self.assertEqual(list(r), [alpha])
+        # the ordering of the keys in the stored text doesn't matter
+        gamma = SerializedDataBag.objects.create(name='gamma', data={'v3': OrderedDict([('b', 2), ('a', 1)])})
+        r = SerializedDataBag.objects.filter(data__contains={'v3': OrderedDict([('a', 1), ('b', 2)])})
+        self.assertEqual(list(r), [gamma])
+        sql = str(SerializedDataBag.objects.filter(data__gt={'v': 10, 'v3': {'a': 1}}).query)
+        self.assertIn("->'v')::bigint >", sql)
+        self.assertIn("->'v3')::jsonb >", sql)
+        # strings are compared as text, rows holding values which aren't json don't break the query
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET data = data || hstore(%%s, %%s) WHERE id = %%s'
+                           % SerializedDataBag._meta.db_table, ['v2', 'zlib:x', gamma.pk])
+        r = SerializedDataBag.objects.filter(data__contains={'v2': '3'})
+        self.assertEqual(list(r), [alpha])
+        self.assertNotIn('jsonb', str(SerializedDataBag.objects.filter(data__gt={'v2': 'x'}).query))
+
+    def test_key_value_casting_bool_query(self):
+        alpha = SerializedDataBag.objects.create(name='alpha', data={'v': True})
+        SerializedDataBag.objects.create(name='beta', data={'v': False})
+        r = SerializedDataBag.objects.filter(data__contains={'v': True})
+        self.assertEqual(list(r), [alpha])
+        r = SerializedDataBag.objects.filter(data__gt={'v': False})
+        self.assertEqual(list(r), [alpha])
+
     def test_key_value_contains_casting_date_query(self):
         date = datetime.date(2014, 9, 28)
         alpha = SerializedDataBag.objects.create(name='alpha', data={'v': date.isoformat()})
@@ -458,3 +498,120 @@ class TestSerializedDictionaryField(TestCase):
     def test_str(self):
         d = SerializedDataBag()
         self.assertEqual(str(d.data), '{}')
+
+    def test_serializer_backends(self):
+        value = {'a': 1, 'b': [1, 'x'], 'c': None, 'd': datetime.date(2016, 1, 1)}
+        serializer = get_serializer('json')
+        encoded = serializer.dumps_dict(value)
+        self.assertEqual(encoded, {'a': '1', 'b': '[1, "x"]', 'c': None, 'd': datetime.date(2016, 1, 1)})
+        self.assertEqual(serializer.loads_dict(encoded), value)
+        self.assertIsInstance(hstore.SerializedDictionaryField().backend, JSONSerializer)
+        self.assertIs(hstore.SerializedDictionaryField(serializer='json').backend, serializer)
+        field = hstore.SerializedDictionaryField(serializer='json')
+        self.assertEqual(field.deconstruct()[3], {'serializer': 'json'})
+        self.assertIs(field.clone().backend, serializer)
+        self.assertEqual(hstore.SerializedDictionaryField().deconstruct()[3], {})
+        with override_settings(DJANGO_HSTORE_SERIALIZER='json'):
+            self.assertIs(hstore.SerializedDictionaryField().backend, serializer)
+        field = hstore.SerializedDictionaryField(serializer=lambda v: json.dumps(v, sort_keys=True))
+        self.assertIsInstance(field.backend, CallableSerializer)
+        self.assertEqual(field.get_prep_value({'a': {'y': 1, 'x': 2}}), {'a': '{"x": 2, "y": 1}'})
+        self.assertRaises(ImproperlyConfigured, get_serializer, 'unknown')
+
+    def test_fastest_serializer(self):
+        serializer = get_serializer('fastest')
+        value = {'a': 1, 'b': [1, 'x'], 'c': {'d': True}}
+        self.assertEqual(serializer.loads_dict(serializer.dumps_dict(value)), value)
+        # every json based backend reads the values written by the others
+        self.assertEqual(get_serializer('json').loads_dict(serializer.dumps_dict(value)), value)
+
+    def test_lazy_deserialization(self):
+        self._create_bags()
+        alpha = SerializedDataBag.objects.get(name='alpha')
+        self.assertIsInstance(alpha.data, LazySerializedDict)
+        self.assertEqual(alpha.data['v'], 1)
+        if six.PY3:
+            # the other values are still serialized (on python 2 they are deserialized upfront)
+            self.assertEqual(dict.__getitem__(alpha.data, 'v3'), '{"a": 1}')
+        self.assertEqual(alpha.data, {'v': 1, 'v2': '3', 'v3': {'a': 1}})
+        alpha = SerializedDataBag.objects.get(name='alpha')
+        self.assertEqual(dict(alpha.data), {'v': 1, 'v2': '3', 'v3': {'a': 1}})
+        alpha = SerializedDataBag.objects.get(name='alpha')
+        copy = {}
+        copy.update(alpha.data)
+        self.assertEqual(copy, {'v': 1, 'v2': '3', 'v3': {'a': 1}})
+        alpha = SerializedDataBag.objects.get(name='alpha')
+        self.assertEqual((lambda **kwargs: kwargs)(**alpha.data), {'v': 1, 'v2': '3', 'v3': {'a': 1}})
+        alpha.data['v3']['b'] = 2
+        alpha.save()
+        self.assertEqual(SerializedDataBag.objects.get(name='alpha').data, {'v': 1, 'v2': '3', 'v3': {'a': 1, 'b': 2}})
+
+    def test_lazy_serialize(self):
+        raw = {'a': '[1, 2]', 'b': '{"c": 1}', 'd': None}
+        field = SerializedDataBag._meta.get_field('data')
+        value = LazySerializedDict(raw, field.deserializer)
+        value['a'].append(3)
+        # values which haven't been accessed are not serialized again
+        self.assertEqual(field.get_prep_value(value), {'a': '[1, 2, 3]', 'b': '{"c": 1}', 'd': None})
+        if six.PY3:
+            self.assertEqual(dict.__getitem__(value, 'b'), '{"c": 1}')
+
+    def test_lazy_deserialization_create(self):
+        SerializedDataBagNoID.objects.create(slug='lazy', name='lazy', data={'a': [1, 2], 'b': 3})
+        bag = SerializedDataBagNoID.objects.get(slug='lazy')
+        self.assertIsInstance(bag.data, LazySerializedDict)
+        self.assertEqual(bag.data, {'a': [1, 2], 'b': 3})
+        # an explicit primary key doesn't turn assigned values into raw ones
+        bag = SerializedDataBagNoID(slug='lazy2', name='lazy2', data={'a': [1, 2], 'b': 3})
+        bag.save()
+        self.assertEqual(SerializedDataBagNoID.objects.get(slug='lazy2').data, {'a': [1, 2], 'b': 3})
+
+    def test_hvalues_list(self):
+        alpha, beta = self._create_bags()
+        queryset = SerializedDataBag.objects.order_by('name')
+        self.assertEqual(list(queryset.hvalues_list('data', ['v', 'v3'])), [(1, {'a': 1}), (2, {'a': 2})])
+        self.assertEqual(list(queryset.hvalues_list('data', 'v2', flat=True)), ['3', [1, '4', 5, {'f': 6}]])
+        self.assertEqual(list(queryset.hvalues_list('data', 'v', flat=True, cast=int)), [1, 2])
+
+    def test_memoize_values(self):
+        for name in ('alpha', 'beta'):
+            SerializedDataBag.objects.create(name=name, data={
+                'flag': True, 'label': 'shared label', 'tags': ['a', 'b'], 'nested': {'c': [1]}
+            })
+        alpha, beta = SerializedDataBag.objects.order_by('name')
+        self.assertIsNot(alpha.data['label'], beta.data['label'])
+        alpha, beta = SerializedDataBag.objects.memoize_values().order_by('name')
+        self.assertEqual(alpha.data, beta.data)
+        # identical immutable values are deserialized once and shared between the rows
+        self.assertIs(alpha.data['label'], beta.data['label'])
+        # mutable values are not shared
+        self.assertIsNot(alpha.data['tags'], beta.data['tags'])
+        self.assertIsNot(alpha.data['nested']['c'], beta.data['nested']['c'])
+        alpha.data['tags'].append('c')
+        self.assertEqual(beta.data['tags'], ['a', 'b'])
+
+    def test_deserialization_memo(self):
+        memo = DeserializationMemo(maxsize=2)
+        loads = get_serializer('json').loads
+        self.assertIs(memo.loads('"text"', loads), memo.loads('"text"', loads))
+        first, second = memo.loads('[1, 2]', loads), memo.loads('[1, 2]', loads)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        # the memo is full
+        memo.loads('true', loads)
+        self.assertEqual(memo.size, 2)
+
+    def test_compress_threshold(self):
+        field = hstore.SerializedDictionaryField(compress_threshold=100)
+        value = {'small': [1, 2], 'large': ['value %d' % i for i in range(100)], 'none': None}
+        prepared = field.get_prep_value(value)
+        self.assertEqual(prepared['small'], '[1, 2]')
+        self.assertTrue(prepared['large'].startswith('zlib:'))
+        self.assertLess(len(prepared['large']), len(json.dumps(value['large'])))
+        self.assertEqual(field.to_python(prepared), value)
+        stats = field.compression_stats
+        self.assertEqual((stats.compressed, stats.decompressed), (1, 1))
+        self.assertLess(stats.ratio, 1)
+        self.assertIsNone(hstore.SerializedDictionaryField().compression_stats)
+        self.assertEqual(field.deconstruct()[3], {'compress_threshold': 100})
+        self.assertEqual(field.clone().compress_threshold, 100)